@@ -6,7 +6,7 @@ import os
 import logging
 import sys
 from dotenv import load_dotenv
-from utils import get_db, load_premium_cache  # <--- Imported load_premium_cache
+from utils import repo, run_db, get_db, write_queue, ensure_indexes, backfill_transcript_tokens, load_premium_cache, premium_expiry, GuildConfigCache, OutboundScheduler, StickyStates, StickyState  # <--- Imported load_premium_cache
 
 # --- LOGGING CONFIGURATION ---
 logging.basicConfig(
@@ -23,32 +23,68 @@ load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 DEFAULT_PREFIX = "!"
 
+# --- SHARDING ---
+# Multi-process deployments give each process a shard range, e.g.
+# SHARD_COUNT=8 SHARD_IDS=0-3 and SHARD_COUNT=8 SHARD_IDS=4-7
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0)) or None
+
+def parse_shard_ids(value):
+    """Parses "0,1,2" or "0-3" (or a mix) into a list of shard IDs."""
+    if not value: return None
+    ids = []
+    for part in value.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            ids.extend(range(int(start), int(end) + 1))
+        elif part.strip():
+            ids.append(int(part))
+    return ids
+
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS"))
+
+# Guild data is loaded on GUILD_CREATE, a batch of guilds per $in query
+HYDRATE_BATCH = 100
+HYDRATE_DELAY = 0.5  # seconds to let a burst of GUILD_CREATEs accumulate
+HYDRATE_RETRY = 30   # seconds before retrying a batch that failed to load
+
 async def get_prefix(bot, message):
     if not message.guild:
         return DEFAULT_PREFIX
-    return bot.prefix_cache.get(message.guild.id, DEFAULT_PREFIX)
+    return bot.guild_configs.get(message.guild.id).get("prefix", DEFAULT_PREFIX)
 
 class GumitBot(commands.AutoShardedBot):
     def __init__(self):
         intents = discord.Intents.default()
         intents.message_content = True
         intents.members = True 
-        super().__init__(command_prefix=get_prefix, intents=intents, help_command=None)
+        super().__init__(command_prefix=get_prefix, intents=intents, help_command=None, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
         
         # --- CACHES ---
-        self.sticky_cache = {}        
-        self.last_sticky_ids = {}     
-        self.sticky_locks = {}
-        self.sticky_cooldowns = {}         
-        self.prefix_cache = {} 
+        self.stickies = StickyStates()  # channel_id -> StickyState
+        self.guild_configs = GuildConfigCache()
         self.welcome_cache = {}
         self.snipe_cache = {} 
         self.afk_cache = {} 
         self.sticky_roles_enabled = set()
         self.start_time = datetime.now()
 
+        # Rate-limit-aware queue for logs, stickies and welcomes
+        self.outbound = OutboundScheduler()
+
+        # --- LAZY GUILD HYDRATION ---
+        self._hydrate_pending = {}
+        self._hydrate_task = None
+        self._hydrated = set()  # guild IDs loaded this session
+
     async def setup_hook(self):
-        self.load_cache()
+        await self.load_cache()
+        premium_expiry.start()
+        write_queue.start()
+        self.outbound.start()
+        self._index_task = asyncio.create_task(run_db(ensure_indexes))
+        # One-off for transcripts from before search; one process is enough
+        if not self.shard_ids or 0 in self.shard_ids:
+            self._backfill_task = asyncio.create_task(run_db(backfill_transcript_tokens))
         
         # --- MODULE LOADER ---
         target_folders = ['cogs', 'dont_touch', 'premium']
@@ -78,33 +114,95 @@ class GumitBot(commands.AutoShardedBot):
         logger.info("--- SYSTEM READY ---")
         await self.tree.sync()
 
-    def load_cache(self):
-        """Loads all persistent data from MongoDB into memory."""
-        db = get_db()
-        if db is None: return
+    async def close(self):
+        # Don't lose queued writes on shutdown
+        self.outbound.stop()
+        await write_queue.close()
+        await super().close()
 
+    async def load_cache(self):
+        """Loads global (not guild-scoped) data from MongoDB into memory."""
         # 1. Load Premium Users (NEW: Performance Fix)
-        load_premium_cache()
-
-        # 2. Load Sticky Messages (Restored)
-        for doc in db.sticky_messages.find():
-            self.sticky_cache[doc["_id"]] = doc
-            self.sticky_locks[doc["_id"]] = asyncio.Lock()
+        await run_db(load_premium_cache)
 
-        # 3. Load Prefixes
-        for doc in db.guild_configs.find():
-            self.prefix_cache[doc["_id"]] = doc.get("prefix", DEFAULT_PREFIX)
-
-        # 4. Load Welcome Channels
-        for doc in db.welcome_configs.find():
-            self.welcome_cache[doc["_id"]] = doc["channel_id"]
+        logger.info("📦 MongoDB Data & Caches Loaded")
 
-        # 5. Load Sticky Roles (Restored)
-        for doc in db.sticky_roles_config.find():
+    # --- PER-GUILD CACHE HYDRATION ---
+
+    async def on_guild_available(self, guild):
+        self.queue_hydration(guild)
+
+    async def on_guild_join(self, guild):
+        self.queue_hydration(guild)
+
+    async def on_guild_remove(self, guild):
+        self._hydrate_pending.pop(guild.id, None)
+        self._hydrated.discard(guild.id)
+        self.guild_configs.evict(guild.id)
+        self.welcome_cache.pop(guild.id, None)
+        self.sticky_roles_enabled.discard(guild.id)
+        for channel in guild.text_channels:
+            self.stickies.discard(channel.id)
+
+    def owns_guild(self, guild_id):
+        """True if the guild belongs to one of this process's shards."""
+        if not self.shard_ids: return True
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    def queue_hydration(self, guild):
+        """Schedules a guild's cached data to be loaded with the next batch."""
+        if not self.owns_guild(guild.id): return
+        # Re-identifies and outage recoveries fire guild_available again; the
+        # cache is already authoritative (it may hold writes still queued)
+        if guild.id in self._hydrated: return
+        self._hydrate_pending[guild.id] = guild
+        if self._hydrate_task is None or self._hydrate_task.done():
+            self._hydrate_task = asyncio.create_task(self._drain_hydration())
+
+    async def _drain_hydration(self):
+        await asyncio.sleep(HYDRATE_DELAY)
+        while self._hydrate_pending:
+            ids = list(self._hydrate_pending)[:HYDRATE_BATCH]
+            batch = [self._hydrate_pending.pop(gid) for gid in ids]
+            try:
+                await self.hydrate_guilds(batch)
+            except Exception as e:
+                logger.error(f"Failed to hydrate {len(batch)} guilds, retrying in {HYDRATE_RETRY}s: {e}")
+                for guild in batch:
+                    self._hydrate_pending.setdefault(guild.id, guild)
+                await asyncio.sleep(HYDRATE_RETRY)
+
+    async def hydrate_guilds(self, guilds):
+        """Loads cached data for a batch of guilds, one $in query per collection."""
+        guild_ids = [g.id for g in guilds]
+        channel_ids = [c.id for g in guilds for c in g.text_channels]
+        # Reads return nothing without a database; don't mistake that for unconfigured
+        if await run_db(get_db) is None:
+            raise RuntimeError("database unavailable")
+
+        # 1. Sticky Messages (keyed by channel)
+        for doc in await repo.stickies_for(channel_ids):
+            # Keep live state (timer, lock, newer message ID) across re-hydration
+            if doc["_id"] not in self.stickies:
+                self.stickies[doc["_id"]] = StickyState(doc)
+
+        # 2. Guild Configs (prefix, mod roles, log channel)
+        self.guild_configs.load(await repo.guild_configs_for(guild_ids))
+        for guild_id in guild_ids:
+            self.dispatch("guild_config_update", guild_id)
+
+        # 3. Welcome Channels
+        for doc in await repo.welcome_configs_for(guild_ids):
+            # A /setwelcome made before hydration is newer than the DB
+            self.welcome_cache.setdefault(doc["_id"], doc["channel_id"])
+
+        # 4. Sticky Roles
+        for doc in await repo.sticky_roles_for(guild_ids):
             if doc.get("enabled"):
                 self.sticky_roles_enabled.add(doc["_id"])
 
-        logger.info("📦 MongoDB Data & Caches Loaded")
+        self._hydrated.update(guild_ids)
+        logger.info(f"📦 Hydrated caches for {len(guild_ids)} guilds")
 
 bot = GumitBot()
 
@@ -3,10 +3,15 @@ from discord.ext import commands
 from discord import ui
 import asyncio
 import uuid
-import io
 import time
 import datetime
-from utils import get_db
+import bisect
+import logging
+import tempfile
+import zlib
+from utils import repo, search_tokens, TRANSCRIPT_MAX_TOKENS
+
+logger = logging.getLogger("Tickets")
 
 # --- CONSTANTS ---
 OPEN_COLOR = 0x5865F2    # Blurple
@@ -26,65 +31,343 @@ DEFAULT_CONFIG = {
     "templates": {} 
 }
 
+TRANSCRIPT_HISTORY_LIMIT = 5000
+SEARCH_PAGE_SIZE = 10
+# Upper edges (seconds) of the time-to-close histogram kept in the daily rollups
+CLOSE_BUCKETS = [300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400]
+TICKET_CREATE_CONCURRENCY = 2  # tickets created at once per guild; more clicks wait their turn
+TRANSCRIPT_SPOOL_BYTES = 1024 * 1024  # transcripts above this spill to a temp file
+
+# guild_id -> config merged over DEFAULT_CONFIG. Guilds without a stored
+# config are cached too, so a miss only ever costs one read.
+_config_cache = {}
+
+# guild_id -> frozenset of role IDs that count as ticket staff. Dropped when
+# the ticket support role changes or a guild_config_update event fires.
+_staff_roles = {}
+
+# Ticket channels being deleted by close_ticket_logic
+_closing = set()
+
 # --- HELPERS ---
 
-def get_config(guild_id):
-    db = get_db()
-    conf = db.ticket_configs.find_one({"_id": guild_id})
-    if not conf: return DEFAULT_CONFIG.copy()
+def merge_config(doc):
     merged = DEFAULT_CONFIG.copy()
-    merged.update(conf)
-    if "templates" not in merged: merged["templates"] = {}
+    if doc: merged.update(doc)
+    merged["templates"] = dict(merged.get("templates") or {})
     return merged
 
-def update_config(guild_id, data):
-    db = get_db()
-    db.ticket_configs.update_one({"_id": guild_id}, {"$set": data}, upsert=True)
-
-def is_staff(interaction):
+async def get_config(guild_id):
+    """Returns the cached ticket config. Treat it as read-only and save changes through update_config."""
+    conf = _config_cache.get(guild_id)
+    if conf is None:
+        conf = merge_config(await repo.get_ticket_config(guild_id))
+        _config_cache[guild_id] = conf
+    return conf
+
+async def update_config(guild_id, data):
+    """Queues the changed fields for MongoDB and refreshes the cached copy."""
+    repo.update_ticket_config(guild_id, data)
+    merged = dict(await get_config(guild_id))
+    merged.update(data)
+    _config_cache[guild_id] = merge_config(merged)
+    if "ping_role" in data:
+        _staff_roles.pop(guild_id, None)
+
+async def staff_roles(bot, guild_id):
+    """The guild's mod roles plus its ticket support role, built once per config change."""
+    roles = _staff_roles.get(guild_id)
+    if roles is None:
+        ids = set(bot.guild_configs.get(guild_id).get("mod_roles") or ())
+        ping_role = (await get_config(guild_id)).get("ping_role")
+        if ping_role: ids.add(ping_role)
+        roles = _staff_roles[guild_id] = frozenset(ids)
+    return roles
+
+async def is_staff(interaction):
     if interaction.user.guild_permissions.administrator: return True
-    db = get_db()
-    
-    g_conf = db.guild_configs.find_one({"_id": interaction.guild.id}) or {}
-    if "mod_roles" in g_conf:
-        if any(r.id in g_conf["mod_roles"] for r in interaction.user.roles): return True
-        
-    t_conf = db.ticket_configs.find_one({"_id": interaction.guild.id}) or {}
-    if t_conf.get("ping_role"):
-        if interaction.user.get_role(t_conf["ping_role"]): return True
-    return False
+    staff = await staff_roles(interaction.client, interaction.guild.id)
+    return bool(staff) and not staff.isdisjoint(r.id for r in interaction.user.roles)
+
+def is_ticket_channel(channel):
+    return isinstance(channel, discord.TextChannel) and channel.name.startswith("ticket-")
+
+def log_message(message, kind="message"):
+    """Appends a message (or a new revision of it) to its ticket's log."""
+    repo.log_ticket_entry({
+        "channel_id": message.channel.id,
+        "guild_id": message.guild.id,
+        "kind": kind,
+        "message_id": message.id,
+        "author_id": message.author.id,
+        "author": message.author.name,
+        "content": message.content,
+        "attachments": [a.url for a in message.attachments],
+        "at": (message.edited_at or message.created_at).timestamp()
+    })
+
+def format_log_entry(entry):
+    stamp = datetime.datetime.fromtimestamp(entry["at"], datetime.timezone.utc).strftime('%Y-%m-%d %H:%M')
+    kind = entry.get("kind")
+    if kind == "open":
+        return f"[{stamp}] -- Ticket opened by {entry['author']} --"
+    if kind == "delete":
+        return f"[{stamp}] (message {entry['message_id']} deleted)"
+    label = f"{entry['author']} (edited)" if kind == "edit" else entry["author"]
+    line = f"[{stamp}] {label}: {entry['content']}"
+    for url in entry.get("attachments") or ():
+        line += f"\n    📎 {url}"
+    return line
+
+class TicketIndex:
+    """
+    Open tickets by (guild, owner) and by channel, backed by open_tickets.
+    Each guild is loaded on first use; tickets from before the index existed
+    are adopted from their "Owner: <id>" topic at that point, once.
+    """
+    def __init__(self):
+        self.by_owner = {}    # (guild_id, user_id) -> channel_id
+        self.by_channel = {}  # channel_id -> (guild_id, user_id)
+        self._loaded = set()
+        self._archiving = set()  # background archive tasks, kept so they aren't collected
+
+    async def load(self, guild, deleting=None):
+        """deleting: a channel being deleted right now, left for the caller to archive."""
+        if guild.id in self._loaded: return
+        docs = await repo.open_tickets_for(guild.id)
+        if guild.id in self._loaded: return
+        self._loaded.add(guild.id)
+
+        for doc in docs:
+            if doc["_id"] == deleting or guild.get_channel(doc["_id"]):
+                self._set(guild.id, doc["owner_id"], doc["_id"])
+            else:
+                # Deleted while we were offline: archive its log in the background
+                repo.remove_open_ticket(doc["_id"])
+                task = asyncio.create_task(archive_deleted_ticket(guild, doc["_id"], f"ticket ({doc['_id']})", doc["owner_id"]))
+                self._archiving.add(task)
+                task.add_done_callback(self._archiving.discard)
+        for channel in guild.text_channels:
+            if channel.id in self.by_channel or not is_ticket_channel(channel): continue
+            if channel.topic and channel.topic.startswith("Owner:"):
+                try: self.add(guild.id, int(channel.topic.split("Owner:")[-1].strip()), channel.id)
+                except ValueError: pass
+
+    def _set(self, guild_id, user_id, channel_id):
+        self.by_owner[(guild_id, user_id)] = channel_id
+        self.by_channel[channel_id] = (guild_id, user_id)
+
+    def add(self, guild_id, user_id, channel_id):
+        self._set(guild_id, user_id, channel_id)
+        repo.add_open_ticket(channel_id, guild_id, user_id)
+
+    def remove(self, channel_id):
+        key = self.by_channel.pop(channel_id, None)
+        if key is None: return
+        if self.by_owner.get(key) == channel_id:
+            del self.by_owner[key]
+        repo.remove_open_ticket(channel_id)
+
+    def channel_for(self, guild_id, user_id):
+        return self.by_owner.get((guild_id, user_id))
+
+    def owner_of(self, channel_id):
+        key = self.by_channel.get(channel_id)
+        return key[1] if key else None
+
+    def evict(self, guild_id):
+        """Forgets a guild in memory only; its persisted entries stay."""
+        self._loaded.discard(guild_id)
+        for channel_id, key in list(self.by_channel.items()):
+            if key[0] == guild_id:
+                del self.by_channel[channel_id]
+                self.by_owner.pop(key, None)
+
+ticket_index = TicketIndex()
+
+def record_event(guild_id, channel_id, kind, actor_id, duration=None):
+    """
+    Logs a ticket lifecycle event (open, hold, resume, accept, reject, close)
+    and folds it into the guild's rollup for the day, so stats never scan events.
+    """
+    now = time.time()
+    doc = {"guild_id": guild_id, "channel_id": channel_id, "kind": kind, "actor_id": actor_id, "at": now}
+    if duration is not None: doc["duration"] = duration
+    repo.log_ticket_event(doc)
+
+    counter = {"open": "opened", "hold": "held", "accept": "accepted", "reject": "rejected", "close": "closed"}.get(kind)
+    if not counter: return
+    deltas = {counter: 1}
+    if kind != "open" and actor_id:
+        deltas[f"staff.{actor_id}.{counter}"] = 1
+    if duration is not None:
+        deltas["close_seconds"] = duration
+        deltas[f"close_buckets.{bisect.bisect_left(CLOSE_BUCKETS, duration)}"] = 1
+    day = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).strftime("%Y-%m-%d")
+    repo.bump_ticket_stats(guild_id, day, deltas)
+
+def summarize_stats(rollups):
+    """Merges daily rollups into one set of totals, staff counts and close-time buckets."""
+    totals, staff, buckets = {}, {}, [0] * (len(CLOSE_BUCKETS) + 1)
+    for doc in rollups:
+        for key in ("opened", "closed", "held", "accepted", "rejected", "close_seconds"):
+            totals[key] = totals.get(key, 0) + doc.get(key, 0)
+        for i, n in (doc.get("close_buckets") or {}).items():
+            buckets[int(i)] += n
+        for uid, counts in (doc.get("staff") or {}).items():
+            mine = staff.setdefault(int(uid), {})
+            for key, n in counts.items():
+                mine[key] = mine.get(key, 0) + n
+    return totals, staff, buckets
+
+def median_bucket(buckets):
+    """Upper edge of the bucket holding the median close time, None for no data or beyond the last edge."""
+    half, seen = sum(buckets) / 2, 0
+    for i, n in enumerate(buckets):
+        seen += n
+        if n and seen >= half:
+            return CLOSE_BUCKETS[i] if i < len(CLOSE_BUCKETS) else None
+    return None
+
+def format_duration(seconds):
+    if seconds < 3600: return f"{seconds / 60:.0f}m"
+    if seconds < 86400: return f"{seconds / 3600:.1f}h"
+    return f"{seconds / 86400:.1f}d"
+
+class TranscriptBuffer:
+    """
+    Transcript text written line by line into a spooled temp file, so building
+    it is linear and big tickets don't sit in memory while they're archived.
+    Each line is also fed to the compressor and the search token set as it
+    is written, so storing it never needs the whole text back in memory.
+    """
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=TRANSCRIPT_SPOOL_BYTES)
+        self.lines = 0
+        self.size = 0
+        self.tokens = {}  # insertion-ordered set of search words
+        self._deflate = zlib.compressobj()
+        self._compressed = bytearray()
+
+    def write(self, line):
+        data = line.encode("utf-8", "replace") + b"\n"
+        self.file.write(data)
+        self._compressed += self._deflate.compress(data)
+        if len(self.tokens) < TRANSCRIPT_MAX_TOKENS:
+            for word in search_tokens(line):
+                self.tokens.setdefault(word)
+        self.size += len(data)
+        self.lines += 1
+
+    def compressed(self):
+        """Finishes the zlib stream; call once, after the last write."""
+        self._compressed += self._deflate.flush()
+        return bytes(self._compressed)
+
+    def as_file(self, filename):
+        # discord.File reads from our handle and leaves it open
+        self.file.seek(0)
+        return discord.File(self.file, filename=filename)
+
+    def close(self):
+        self.file.close()
+
+def closer_mention(doc):
+    return f"<@{doc['closed_by']}>" if doc.get("closed_by") else "channel deletion"
+
+def write_header(buffer, name, guild, closed_by, reason):
+    buffer.write(f"TRANSCRIPT - {name}")
+    buffer.write(f"Server: {guild.name}")
+    buffer.write(f"Time: {datetime.datetime.now()}")
+    buffer.write(f"Closed By: {closed_by}")
+    buffer.write(f"Reason: {reason}")
+    buffer.write("")
+
+async def archive_deleted_ticket(guild, channel_id, name, owner_id):
+    """
+    Saves whatever was captured for a ticket channel deleted by hand (or while
+    the bot was offline), then drops its log. The log is kept if the
+    transcript can't be stored.
+    """
+    # Closed either way, so it counts towards the stats; nobody to credit
+    opened = discord.utils.snowflake_time(channel_id).timestamp()
+    record_event(guild.id, channel_id, "close", None, duration=time.time() - opened)
+
+    buffer = TranscriptBuffer()
+    try:
+        write_header(buffer, name, guild, "(channel deleted)", "Channel deleted")
+        if not await repo.replay_ticket_log(channel_id, lambda entry: buffer.write(format_log_entry(entry))):
+            return
+        await repo.save_transcript({
+            "case_id": str(uuid.uuid4())[:8],
+            "guild_id": guild.id,
+            "owner_id": owner_id,
+            "closed_by": None,
+            "timestamp": time.time()
+        }, buffer.compressed(), list(buffer.tokens)[:TRANSCRIPT_MAX_TOKENS], buffer.size)
+    except Exception as e:
+        logger.error(f"Failed to archive deleted ticket {channel_id}, keeping its log: {e}")
+        return
+    finally:
+        buffer.close()
+    try:
+        await repo.clear_ticket_log(channel_id)
+    except Exception as e:
+        logger.error(f"Archived deleted ticket {channel_id} but couldn't clear its log: {e}")
 
 async def close_ticket_logic(interaction, closed_by_user, reason="No reason provided"):
+    started = time.perf_counter()
     await interaction.channel.send("🔒 **Archiving Ticket...** Generating transcript...")
     
-    transcript = f"TRANSCRIPT - {interaction.channel.name}\nServer: {interaction.guild.name}\nTime: {datetime.datetime.now()}\n"
-    transcript += f"Closed By: {closed_by_user.name}\nReason: {reason}\n\n"
-    
-    async for m in interaction.channel.history(limit=5000, oldest_first=True):
-        transcript += f"[{m.created_at.strftime('%Y-%m-%d %H:%M')}] {m.author.name}: {m.content}\n"
-    
-    db = get_db()
-    case_id = str(uuid.uuid4())[:8]
-    db.ticket_transcripts.insert_one({
-        "case_id": case_id,
-        "guild_id": interaction.guild.id,
-        "content": transcript,
-        "closed_by": closed_by_user.id,
-        "timestamp": time.time()
-    })
-    
-    if interaction.channel.topic and "Owner:" in interaction.channel.topic:
+    buffer = TranscriptBuffer()
+    try:
+        write_header(buffer, interaction.channel.name, interaction.guild, closed_by_user.name, reason)
+        
+        await ticket_index.load(interaction.guild)
+        owner_id = ticket_index.owner_of(interaction.channel.id)
+        case_id = str(uuid.uuid4())[:8]
         try:
-            uid = int(interaction.channel.topic.split("Owner:")[-1].strip())
-            owner = interaction.guild.get_member(uid)
-            if owner:
-                conf = get_config(interaction.guild.id)
-                msg = conf.get("closing", "Ticket Closed.").replace("{user}", owner.name).replace("{server}", interaction.guild.name)
-                f = discord.File(io.StringIO(transcript), filename=f"ticket-{case_id}.txt")
-                await owner.send(f"{msg}\n**Reason:** {reason}\nCase ID: `{case_id}`", file=f)
-        except: pass
-
+            if await repo.ticket_log_started(interaction.channel.id):
+                # Everything was captured as it happened; just replay the log
+                await repo.replay_ticket_log(interaction.channel.id, lambda entry: buffer.write(format_log_entry(entry)))
+            else:
+                async for m in interaction.channel.history(limit=TRANSCRIPT_HISTORY_LIMIT, oldest_first=True):
+                    buffer.write(f"[{m.created_at.strftime('%Y-%m-%d %H:%M')}] {m.author.name}: {m.content}")
+            
+            await repo.save_transcript({
+                "case_id": case_id,
+                "guild_id": interaction.guild.id,
+                "owner_id": owner_id,
+                "closed_by": closed_by_user.id,
+                "timestamp": time.time()
+            }, buffer.compressed(), list(buffer.tokens)[:TRANSCRIPT_MAX_TOKENS], buffer.size)
+        except Exception as e:
+            # Nothing is deleted unless the transcript is safely stored
+            logger.error(f"Failed to save transcript for {interaction.channel.id}: {e}")
+            return await interaction.channel.send("❌ **Couldn't save the transcript.** The ticket was left open, please try closing it again.")
+        
+        if owner_id:
+            try:
+                owner = interaction.guild.get_member(owner_id)
+                if owner:
+                    conf = await get_config(interaction.guild.id)
+                    msg = conf.get("closing", "Ticket Closed.").replace("{user}", owner.name).replace("{server}", interaction.guild.name)
+                    f = buffer.as_file(f"ticket-{case_id}.txt")
+                    await owner.send(f"{msg}\n**Reason:** {reason}\nCase ID: `{case_id}`", file=f)
+            except: pass
+    finally:
+        buffer.close()
+
+    # Our own delete; on_guild_channel_delete leaves the cleanup to us
+    _closing.add(interaction.channel.id)
     await interaction.channel.delete()
+    record_event(interaction.guild.id, interaction.channel.id, "close", closed_by_user.id, duration=time.time() - interaction.channel.created_at.timestamp())
+    ticket_index.remove(interaction.channel.id)
+    try:
+        await repo.clear_ticket_log(interaction.channel.id)
+    except Exception as e:
+        logger.error(f"Closed ticket {case_id} but couldn't clear its log: {e}")
+    logger.info(f"Closed ticket {case_id} in {interaction.guild.id}: {buffer.lines} lines, {(time.perf_counter() - started) * 1000:.0f}ms")
 
 # --- MODALS ---
 
@@ -94,7 +377,7 @@ class UserCloseRequestModal(ui.Modal, title="Request to Close Ticket"):
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.defer()
         
-        conf = get_config(interaction.guild.id)
+        conf = await get_config(interaction.guild.id)
         ping = f"<@&{conf['ping_role']}>" if conf.get('ping_role') else "Staff"
         
         embed = discord.Embed(title="⚠️ User Requested Close", description=f"**Reason:** {self.reason.value}", color=discord.Color.orange())
@@ -113,16 +396,15 @@ class TemplateAddModal(ui.Modal, title="➕ Add Smart Reply"):
         self.view_ref = view
 
     async def on_submit(self, interaction: discord.Interaction):
-        conf = get_config(interaction.guild.id)
-        templates = conf.get("templates", {})
+        conf = await get_config(interaction.guild.id)
+        templates = dict(conf.get("templates", {}))
         
         templates[self.name.value.lower()] = {
             "content": self.content.value,
             "image": self.image_url.value if self.image_url.value else None
         }
         
-        conf["templates"] = templates
-        update_config(interaction.guild.id, conf)
+        await update_config(interaction.guild.id, {"templates": templates})
         await interaction.response.send_message(f"✅ Template `{self.name.value}` saved!", ephemeral=True)
 
 class AnonReplyModal(ui.Modal, title="🕵️ Anonymous Reply"):
@@ -150,6 +432,7 @@ class ResolutionReasonModal(ui.Modal):
         embed = discord.Embed(title=f"Ticket {self.status_label}", description=f"**Reason:** {self.reason.value}", color=self.color)
         embed.set_author(name=interaction.user.name, icon_url=interaction.user.avatar.url)
         await interaction.channel.send(embed=embed)
+        record_event(interaction.guild.id, interaction.channel.id, "reject" if self.is_reject else "accept", interaction.user.id)
         
         if self.is_reject:
             await asyncio.sleep(3)
@@ -174,7 +457,7 @@ class ConfigTextModal(ui.Modal, title="📝 Edit Ticket Design"):
     async def on_submit(self, interaction: discord.Interaction):
         new_data = {"title": self.m_title.value, "desc": self.m_desc.value, "btn_text": self.m_btn_txt.value, "btn_emoji": self.m_btn_emoji.value, "welcome": self.m_welcome.value}
         self.dashboard_view.config.update(new_data)
-        update_config(interaction.guild.id, self.dashboard_view.config)
+        await update_config(interaction.guild.id, new_data)
         await self.dashboard_view.refresh_dashboard(interaction)
 
 # --- VIEWS ---
@@ -229,7 +512,7 @@ class TicketActionsView(ui.View):
 
     @ui.button(label="Close", style=discord.ButtonStyle.secondary, emoji="🔒", custom_id="tick_act_close", row=0)
     async def close(self, interaction: discord.Interaction, button: ui.Button):
-        if is_staff(interaction):
+        if await is_staff(interaction):
             await interaction.response.defer()
             await close_ticket_logic(interaction, interaction.user, "Staff Closed")
         else:
@@ -237,17 +520,17 @@ class TicketActionsView(ui.View):
 
     @ui.button(label="Accepted", style=discord.ButtonStyle.success, emoji="✅", custom_id="tick_act_acc", row=0)
     async def accepted(self, interaction: discord.Interaction, button: ui.Button):
-        if not is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
+        if not await is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
         await interaction.response.send_modal(ResolutionReasonModal("Accepted", ACC_COLOR, self))
 
     @ui.button(label="Rejected", style=discord.ButtonStyle.danger, emoji="✖️", custom_id="tick_act_rej", row=0)
     async def rejected(self, interaction: discord.Interaction, button: ui.Button):
-        if not is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
+        if not await is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
         await interaction.response.send_modal(ResolutionReasonModal("Rejected", REJ_COLOR, self, is_reject=True))
 
     @ui.button(label="Hold", style=discord.ButtonStyle.primary, emoji="✋", custom_id="tick_act_hold", row=1)
     async def hold(self, interaction: discord.Interaction, button: ui.Button):
-        if not is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
+        if not await is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
         await interaction.response.defer()
         embed = interaction.message.embeds[0]
         if embed.color.value == HOLD_COLOR:
@@ -256,19 +539,21 @@ class TicketActionsView(ui.View):
             button.label = "Hold"
             button.style = discord.ButtonStyle.primary
             await interaction.channel.send("▶️ **Ticket Resumed.**", delete_after=3)
+            record_event(interaction.guild.id, interaction.channel.id, "resume", interaction.user.id)
         else:
             embed.color = HOLD_COLOR
             embed.set_footer(text="Status: ⚠️ Tickets are on Hold")
             button.label = "Unhold"
             button.style = discord.ButtonStyle.danger
             await interaction.channel.send("⏸️ **Ticket Placed on Hold.**", delete_after=3)
+            record_event(interaction.guild.id, interaction.channel.id, "hold", interaction.user.id)
         await interaction.message.edit(embed=embed, view=self)
 
     @ui.button(label="Smart Reply", style=discord.ButtonStyle.secondary, emoji="🤖", custom_id="tick_act_smart", row=1)
     async def smart_reply(self, interaction: discord.Interaction, button: ui.Button):
-        if not is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
+        if not await is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
         
-        conf = get_config(interaction.guild.id)
+        conf = await get_config(interaction.guild.id)
         templates = conf.get("templates", {})
         
         # DISPLAY ACTIVE TEMPLATES
@@ -288,9 +573,57 @@ class TicketActionsView(ui.View):
 
     @ui.button(label="Anon Reply", style=discord.ButtonStyle.secondary, emoji="🕵️", custom_id="tick_act_anon", row=1)
     async def anon_reply(self, interaction: discord.Interaction, button: ui.Button):
-        if not is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
+        if not await is_staff(interaction): return await interaction.response.send_message("⛔ Staff Only.", ephemeral=True)
         await interaction.response.send_modal(AnonReplyModal())
 
+class TranscriptSearchView(ui.View):
+    """Pages through search_transcripts results for the staff member who searched."""
+    def __init__(self, author, guild, words, filters):
+        super().__init__(timeout=180)
+        self.author = author
+        self.guild = guild
+        self.words = words
+        self.filters = filters
+        self.page = 0
+        self.results = []
+
+    async def load(self):
+        # One extra row tells us whether there is a next page
+        rows = await repo.search_transcripts(self.guild.id, self.words, skip=self.page * SEARCH_PAGE_SIZE, limit=SEARCH_PAGE_SIZE + 1, **self.filters)
+        self.results = rows[:SEARCH_PAGE_SIZE]
+        self.prev.disabled = self.page == 0
+        self.next.disabled = len(rows) <= SEARCH_PAGE_SIZE
+
+    def create_embed(self):
+        query = " ".join(self.words) or "everything"
+        embed = discord.Embed(title="🔎 Transcript Search", description=f"Matching: `{query}`", color=discord.Color.blue())
+        if not self.results:
+            embed.description += "\n\nNo transcripts found."
+        for doc in self.results:
+            owner = f"<@{doc['owner_id']}>" if doc.get("owner_id") else "unknown"
+            embed.add_field(
+                name=f"Case {doc['case_id']}",
+                value=f"<t:{int(doc['timestamp'])}:f> • Owner {owner} • Closed by {closer_mention(doc)}",
+                inline=False
+            )
+        embed.set_footer(text=f"Page {self.page + 1} • /ticket_manage transcript <case> to download")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return interaction.user.id == self.author.id
+
+    @ui.button(label="Previous", style=discord.ButtonStyle.secondary, emoji="◀️")
+    async def prev(self, interaction: discord.Interaction, button: ui.Button):
+        self.page -= 1
+        await self.load()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
+    @ui.button(label="Next", style=discord.ButtonStyle.secondary, emoji="▶️")
+    async def next(self, interaction: discord.Interaction, button: ui.Button):
+        self.page += 1
+        await self.load()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
 # --- ADMIN DASHBOARD ---
 
 class TemplateManagerView(ui.View):
@@ -304,7 +637,7 @@ class TemplateManagerView(ui.View):
 
     @ui.button(label="Delete Template", style=discord.ButtonStyle.danger, emoji="🗑️")
     async def del_t(self, interaction: discord.Interaction, button: ui.Button):
-        conf = get_config(self.guild_id)
+        conf = await get_config(self.guild_id)
         templates = conf.get("templates", {})
         if not templates: return await interaction.response.send_message("❌ No templates.", ephemeral=True)
         
@@ -313,8 +646,9 @@ class TemplateManagerView(ui.View):
         select = ui.Select(placeholder="Delete...", options=options)
         
         async def callback(inter):
-            del conf["templates"][select.values[0]]
-            update_config(self.guild_id, conf)
+            current = await get_config(self.guild_id)
+            remaining = {k: v for k, v in current["templates"].items() if k != select.values[0]}
+            await update_config(self.guild_id, {"templates": remaining})
             await inter.response.send_message(f"🗑️ Deleted `{select.values[0]}`.", ephemeral=True)
         
         select.callback = callback
@@ -328,14 +662,14 @@ class RoleSelectionView(ui.View):
     @ui.select(cls=discord.ui.RoleSelect, placeholder="Select Support Role", min_values=1, max_values=1)
     async def select_role(self, interaction: discord.Interaction, select: ui.RoleSelect):
         self.dashboard_view.config["ping_role"] = select.values[0].id
-        update_config(interaction.guild.id, self.dashboard_view.config)
+        await update_config(interaction.guild.id, {"ping_role": select.values[0].id})
         await self.dashboard_view.refresh_dashboard(interaction)
 
 class AdminDashboardView(ui.View):
-    def __init__(self, guild_id):
+    def __init__(self, guild_id, config):
         super().__init__(timeout=None)
         self.guild_id = guild_id
-        self.config = get_config(guild_id)
+        self.config = dict(config)
 
     def create_embed(self):
         embed = discord.Embed(title="🎛️ Ticket System Admin", color=discord.Color.blue())
@@ -375,7 +709,7 @@ class AdminDashboardView(ui.View):
     async def templates(self, interaction: discord.Interaction, button: ui.Button):
         # --- THIS IS THE FIX ---
         # Fetch fresh config to ensure list is up to date
-        conf = get_config(self.guild_id)
+        conf = await get_config(self.guild_id)
         templates = conf.get("templates", {})
         
         embed = discord.Embed(title="Template Manager", color=discord.Color.gold())
@@ -403,15 +737,31 @@ class AdminDashboardView(ui.View):
 class Tickets(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self._creating = set()       # (guild_id, user_id) with a creation in flight
+        self._create_slots = {}      # guild_id -> Semaphore
+        self._category_locks = {}    # guild_id -> Lock
 
     async def cog_load(self):
         self.bot.add_view(TicketLaunchView("Open Ticket", "📩"))
         self.bot.add_view(TicketActionsView())
 
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        _config_cache.pop(guild.id, None)
+        _staff_roles.pop(guild.id, None)
+        ticket_index.evict(guild.id)
+        self._create_slots.pop(guild.id, None)
+        self._category_locks.pop(guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_config_update(self, guild_id):
+        # Mod roles may have changed (/setup, hydration)
+        _staff_roles.pop(guild_id, None)
+
     @commands.hybrid_command(name="ticket", description="Open the Ticket Administration Dashboard.")
     @commands.has_permissions(administrator=True)
     async def ticket_cmd(self, ctx):
-        view = AdminDashboardView(ctx.guild.id)
+        view = AdminDashboardView(ctx.guild.id, await get_config(ctx.guild.id))
         embed = view.create_embed()
         await ctx.send(embed=embed, view=view)
 
@@ -442,32 +792,140 @@ class Tickets(commands.Cog):
         embed.set_footer(text="Staff Reply")
         await ctx.send(embed=embed)
 
+    @t_manage.command(name="transcript", description="Fetch a closed ticket's transcript by case ID.")
+    @commands.has_permissions(manage_messages=True)
+    async def transcript_cmd(self, ctx, case_id: str):
+        found = await repo.open_transcript(ctx.guild.id, case_id.strip().strip("`"))
+        if not found: return await ctx.send(f"❌ No transcript with case ID `{case_id}` in this server.", ephemeral=True)
+
+        doc, fp = found
+        try:
+            closed = f"<t:{int(doc['timestamp'])}:f>" if doc.get("timestamp") else "unknown"
+            await ctx.send(f"📄 Case `{doc['case_id']}` • Closed by {closer_mention(doc)} on {closed}", file=discord.File(fp, filename=f"ticket-{doc['case_id']}.txt"), ephemeral=True)
+        finally:
+            fp.close()
+
+    @t_manage.command(name="search", description="Search closed ticket transcripts.")
+    @commands.has_permissions(manage_messages=True)
+    async def search_cmd(self, ctx, query: str = "", user: discord.User = None, closer: discord.User = None, days: int = None):
+        filters = {
+            "owner_id": user.id if user else None,
+            "closed_by": closer.id if closer else None,
+            "since": time.time() - days * 86400 if days else None
+        }
+        view = TranscriptSearchView(ctx.author, ctx.guild, search_tokens(query), filters)
+        await view.load()
+        await ctx.send(embed=view.create_embed(), view=view, ephemeral=True)
+
+    @t_manage.command(name="stats", description="Ticket statistics for this server.")
+    @commands.has_permissions(manage_messages=True)
+    async def stats_cmd(self, ctx, days: int = 30):
+        days = max(1, min(days, 365))
+        since = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        totals, staff, buckets = summarize_stats(await repo.ticket_stats_since(ctx.guild.id, since))
+
+        embed = discord.Embed(title="📈 Ticket Stats", description=f"Last {days} day(s)", color=discord.Color.blue())
+        embed.add_field(name="Opened", value=str(totals.get("opened", 0)), inline=True)
+        embed.add_field(name="Closed", value=str(totals.get("closed", 0)), inline=True)
+        embed.add_field(name="Held", value=str(totals.get("held", 0)), inline=True)
+        embed.add_field(name="Accepted", value=str(totals.get("accepted", 0)), inline=True)
+        embed.add_field(name="Rejected", value=str(totals.get("rejected", 0)), inline=True)
+
+        closed = totals.get("closed", 0)
+        if closed:
+            median = median_bucket(buckets)
+            median_text = f"≤ {format_duration(median)}" if median else f"> {format_duration(CLOSE_BUCKETS[-1])}"
+            embed.add_field(name="Time to Close", value=f"Median {median_text}\nMean {format_duration(totals['close_seconds'] / closed)}", inline=True)
+
+        top = sorted(staff.items(), key=lambda item: -sum(item[1].values()))[:10]
+        if top:
+            lines = [f"<@{uid}>: {c.get('closed', 0)} closed • {c.get('accepted', 0)} accepted • {c.get('rejected', 0)} rejected • {c.get('held', 0)} held" for uid, c in top]
+            embed.add_field(name="👮 Staff", value="\n".join(lines), inline=False)
+        await ctx.send(embed=embed, ephemeral=True)
+
+    # --- TRANSCRIPT CAPTURE ---
+    @commands.Cog.listener()
+    async def on_message(self, message):
+        if message.guild and is_ticket_channel(message.channel):
+            log_message(message)
+
+    @commands.Cog.listener()
+    async def on_message_edit(self, before, after):
+        if after.guild and is_ticket_channel(after.channel) and before.content != after.content:
+            log_message(after, kind="edit")
+
+    @commands.Cog.listener()
+    async def on_message_delete(self, message):
+        if message.guild and is_ticket_channel(message.channel):
+            repo.log_ticket_entry({"channel_id": message.channel.id, "guild_id": message.guild.id, "kind": "delete", "message_id": message.id, "at": time.time()})
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        if not is_ticket_channel(channel): return
+        if channel.id in _closing:
+            # close_ticket_logic stored the transcript and clears up itself
+            _closing.discard(channel.id)
+            return
+        # Deleted by hand: archive what was captured before dropping it
+        # The channel has already left the guild cache; load() must not archive it too
+        await ticket_index.load(channel.guild, deleting=channel.id)
+        await archive_deleted_ticket(channel.guild, channel.id, channel.name, ticket_index.owner_of(channel.id))
+        ticket_index.remove(channel.id)
+
     @commands.Cog.listener()
     async def on_interaction(self, interaction):
         if interaction.type != discord.InteractionType.component: return
         if interaction.data.get("custom_id") != "ticket_create_v6": return
-        conf = get_config(interaction.guild.id)
-        existing = discord.utils.get(interaction.guild.text_channels, topic=f"Owner: {interaction.user.id}")
-        if existing: return await interaction.response.send_message(f"❌ Ticket exists: {existing.mention}", ephemeral=True)
-
+        guild = interaction.guild
+        user = interaction.user
+
+        # Single flight: repeat clicks while a ticket is being made get one cheap reply
+        key = (guild.id, user.id)
+        if key in self._creating:
+            return await interaction.response.send_message("⏳ Your ticket is already being created.", ephemeral=True)
+        self._creating.add(key)
         try:
-            guild = interaction.guild
-            user = interaction.user
-            overwrites = {guild.default_role: discord.PermissionOverwrite(read_messages=False), user: discord.PermissionOverwrite(read_messages=True, send_messages=True), guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True)}
-            if conf['ping_role']:
-                r = guild.get_role(conf['ping_role'])
-                if r: overwrites[r] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
-            cat = discord.utils.get(guild.categories, name="Tickets") or await guild.create_category("Tickets")
-            chan = await guild.create_text_channel(f"ticket-{user.name}", category=cat, overwrites=overwrites, topic=f"Owner: {user.id}")
-            
-            welcome = conf['welcome'].replace("{user}", user.mention).replace("{server}", guild.name)
-            ping = f"<@&{conf['ping_role']}>" if conf['ping_role'] else ""
-            embed = discord.Embed(description=welcome, color=OPEN_COLOR)
-            embed.set_footer(text="Status: Active")
-            await chan.send(f"{user.mention} {ping}", embed=embed, view=TicketActionsView())
-            await interaction.response.send_message(f"✅ Created: {chan.mention}", ephemeral=True)
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            await ticket_index.load(guild)
+            existing = guild.get_channel(ticket_index.channel_for(guild.id, user.id) or 0)
+            if existing: return await interaction.followup.send(f"❌ Ticket exists: {existing.mention}", ephemeral=True)
+
+            async with self.creation_slots(guild.id):
+                chan = await self.create_ticket(guild, user)
+            await interaction.followup.send(f"✅ Created: {chan.mention}", ephemeral=True)
         except Exception as e:
-            await interaction.response.send_message(f"❌ Error: {e}", ephemeral=True)
+            await interaction.followup.send(f"❌ Error: {e}", ephemeral=True)
+        finally:
+            self._creating.discard(key)
+
+    def creation_slots(self, guild_id):
+        """Bounds how many tickets a guild creates at once, queueing the rest."""
+        slots = self._create_slots.get(guild_id)
+        if slots is None:
+            slots = self._create_slots[guild_id] = asyncio.Semaphore(TICKET_CREATE_CONCURRENCY)
+        return slots
+
+    async def create_ticket(self, guild, user):
+        conf = await get_config(guild.id)
+        overwrites = {guild.default_role: discord.PermissionOverwrite(read_messages=False), user: discord.PermissionOverwrite(read_messages=True, send_messages=True), guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True)}
+        if conf['ping_role']:
+            r = guild.get_role(conf['ping_role'])
+            if r: overwrites[r] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+
+        # Concurrent creations must not each make their own category
+        async with self._category_locks.setdefault(guild.id, asyncio.Lock()):
+            cat = discord.utils.get(guild.categories, name="Tickets") or await guild.create_category("Tickets")
+        chan = await guild.create_text_channel(f"ticket-{user.name}", category=cat, overwrites=overwrites, topic=f"Owner: {user.id}")
+        ticket_index.add(guild.id, user.id, chan.id)
+        record_event(guild.id, chan.id, "open", user.id)
+        repo.log_ticket_entry({"channel_id": chan.id, "guild_id": guild.id, "kind": "open", "author_id": user.id, "author": user.name, "at": time.time()})
+        
+        welcome = conf['welcome'].replace("{user}", user.mention).replace("{server}", guild.name)
+        ping = f"<@&{conf['ping_role']}>" if conf['ping_role'] else ""
+        embed = discord.Embed(description=welcome, color=OPEN_COLOR)
+        embed.set_footer(text="Status: Active")
+        await chan.send(f"{user.mention} {ping}", embed=embed, view=TicketActionsView())
+        return chan
 
 async def setup(bot):
     await bot.add_cog(Tickets(bot))
\ No newline at end of file
@@ -2,7 +2,6 @@ import discord
 from discord.ext import commands
 from discord import ui
 import asyncio
-from utils import get_db
 
 class SetupSession:
     """Helper class to manage the setup state."""
@@ -233,8 +232,8 @@ class Configuration(commands.Cog):
 
         # --- FINISH ---
         # Save to DB
-        db = get_db()
-        db.guild_configs.update_one({"_id": ctx.guild.id}, {"$set": session.config}, upsert=True)
+        self.bot.guild_configs.update(ctx.guild.id, session.config)
+        self.bot.dispatch("guild_config_update", ctx.guild.id)
 
         final_embed = discord.Embed(title="✅ Setup Complete!", color=discord.Color.green())
         
@@ -1,16 +1,17 @@
 import discord
 from discord.ext import commands
 from datetime import datetime
-from utils import get_db
+from utils import PRIORITY_LOGS
+
+LOG_TTL = 300  # seconds a queued log entry may wait before it is dropped
 
 class Events(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
     async def get_log_channel(self, guild):
-        """Fetches the log channel ID from the database config."""
-        db = get_db()
-        config = db.guild_configs.find_one({"_id": guild.id})
+        """Resolves the log channel from the cached guild config."""
+        config = self.bot.guild_configs.get(guild.id)
         if config and "log_channel" in config:
             return guild.get_channel(config["log_channel"])
         return None
@@ -27,7 +28,7 @@ class Events(commands.Cog):
         embed.add_field(name="Channel", value=message.channel.mention, inline=True)
         embed.add_field(name="Content", value=message.content or "[Image/File]", inline=False)
         
-        await log_channel.send(embed=embed)
+        self.bot.outbound.submit(log_channel, PRIORITY_LOGS, ttl=LOG_TTL, embed=embed)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
@@ -42,7 +43,7 @@ class Events(commands.Cog):
         embed.add_field(name="Before", value=before.content[:1024] or "[Empty]", inline=False)
         embed.add_field(name="After", value=after.content[:1024] or "[Empty]", inline=False)
         
-        await log_channel.send(embed=embed)
+        self.bot.outbound.submit(log_channel, PRIORITY_LOGS, ttl=LOG_TTL, embed=embed)
 
 async def setup(bot):
     await bot.add_cog(Events(bot))
\ No newline at end of file
@@ -3,7 +3,9 @@ from discord.ext import commands, tasks
 import asyncio
 from datetime import datetime
 import re
-from utils import get_db
+from utils import repo, PRIORITY_WELCOME
+
+WELCOME_TTL = 60  # a welcome older than this is no longer worth sending
 
 class General(commands.Cog):
     def __init__(self, bot):
@@ -22,7 +24,13 @@ class General(commands.Cog):
         if cid:
             channel = member.guild.get_channel(cid)
             if channel:
-                await channel.send(f"Welcome {member.mention} to {member.guild.name}!")
+                # Joins that pile up during a raid are merged into one message
+                guild_name = member.guild.name
+                def build(mentions):
+                    shown = ", ".join(mentions[:50])
+                    if len(mentions) > 50: shown += f" and {len(mentions) - 50} others"
+                    return {"content": f"Welcome {shown} to {guild_name}!"}
+                self.bot.outbound.submit(channel, PRIORITY_WELCOME, merge_key=("welcome", channel.id), ttl=WELCOME_TTL, build=build, item=member.mention)
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -39,25 +47,14 @@ class General(commands.Cog):
     @commands.hybrid_command(name="setwelcome", description="Set welcome channel.")
     @commands.has_permissions(administrator=True)
     async def setwelcome(self, ctx, channel: discord.TextChannel):
-        db = get_db()
-        db.welcome_configs.update_one(
-            {"_id": ctx.guild.id},
-            {"$set": {"channel_id": channel.id}},
-            upsert=True
-        )
+        repo.set_welcome_channel(ctx.guild.id, channel.id)
         self.bot.welcome_cache[ctx.guild.id] = channel.id
         await ctx.send(f"✅ Welcomes set to {channel.mention}")
 
     @commands.hybrid_command(name="setprefix", description="Change server prefix.")
     @commands.has_permissions(administrator=True)
     async def setprefix(self, ctx, new_prefix: str):
-        db = get_db()
-        db.guild_configs.update_one(
-            {"_id": ctx.guild.id},
-            {"$set": {"prefix": new_prefix}},
-            upsert=True
-        )
-        self.bot.prefix_cache[ctx.guild.id] = new_prefix
+        self.bot.guild_configs.update(ctx.guild.id, {"prefix": new_prefix})
         await ctx.send(f"✅ Prefix changed to `{new_prefix}`")
 
     @commands.hybrid_command(name="snipe", description="Recover last deleted message.")
@@ -84,8 +81,7 @@ class General(commands.Cog):
         await member.add_roles(role)
         expiry = datetime.now().timestamp() + seconds
         
-        db = get_db()
-        db.temp_roles.insert_one({
+        repo.add_temp_role({
             "guild_id": ctx.guild.id,
             "user_id": member.id,
             "role_id": role.id,
@@ -96,13 +92,14 @@ class General(commands.Cog):
     # --- TASKS ---
     @tasks.loop(seconds=60)
     async def check_temp_roles(self):
-        db = get_db()
         now = datetime.now().timestamp()
         
-        # Find expired roles
-        expired_cursor = db.temp_roles.find({"expiry": {"$lte": now}})
+        # Find expired roles (only our own guilds when running a shard range,
+        # otherwise another process's entries would be dropped unprocessed)
+        guild_ids = [g.id for g in self.bot.guilds] if self.bot.shard_ids else None
+        expired = await repo.expired_temp_roles(now, guild_ids)
         
-        for doc in expired_cursor:
+        for doc in expired:
             try:
                 guild = self.bot.get_guild(doc["guild_id"])
                 if guild:
@@ -110,7 +107,7 @@ class General(commands.Cog):
             except: pass
             
             # Delete processed
-            db.temp_roles.delete_one({"_id": doc["_id"]})
+            repo.delete_temp_role(doc["_id"])
 
 async def setup(bot):
     await bot.add_cog(General(bot))
\ No newline at end of file
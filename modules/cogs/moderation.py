@@ -1,7 +1,6 @@
 import discord
 from discord.ext import commands
 from datetime import datetime
-from utils import get_db
 
 class Moderation(commands.Cog):
     def __init__(self, bot):
@@ -12,8 +11,7 @@ class Moderation(commands.Cog):
         """Checks if user is admin or has configured mod role."""
         if ctx.author.guild_permissions.administrator: return True
         
-        db = get_db()
-        config = db.guild_configs.find_one({"_id": ctx.guild.id})
+        config = self.bot.guild_configs.get(ctx.guild.id)
         if config and "mod_roles" in config:
             return any(r.id in config["mod_roles"] for r in ctx.author.roles)
         return False
@@ -22,8 +20,7 @@ class Moderation(commands.Cog):
         """Global check for Slash Commands in this Cog."""
         if interaction.user.guild_permissions.administrator: return True
         
-        db = get_db()
-        config = db.guild_configs.find_one({"_id": interaction.guild.id})
+        config = self.bot.guild_configs.get(interaction.guild.id)
         if config and "mod_roles" in config:
              if any(r.id in config["mod_roles"] for r in interaction.user.roles):
                  return True
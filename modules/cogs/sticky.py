@@ -2,8 +2,23 @@ import discord
 from discord.ext import commands
 from discord import app_commands, ui
 import asyncio
+import math
+import os
 import time
-from utils import get_db
+from utils import repo, PRIORITY_STICKY, StickyState
+
+# --- REPOST TIMING ---
+# A sticky is reposted once the channel has been quiet for the channel's
+# repost delay, or STICKY_MAX_WAIT seconds after the first message of a burst
+# at the latest. The delay scales with the channel's message rate, from
+# STICKY_MIN_DELAY when idle up to STICKY_MAX_DELAY at STICKY_BUSY_RATE msgs/min.
+STICKY_MIN_DELAY = float(os.getenv("STICKY_MIN_DELAY", 2))
+STICKY_MAX_DELAY = float(os.getenv("STICKY_MAX_DELAY", 15))
+STICKY_BUSY_RATE = float(os.getenv("STICKY_BUSY_RATE", 30))
+STICKY_MAX_WAIT = float(os.getenv("STICKY_MAX_WAIT", 30))
+RATE_WINDOW = 60  # seconds; time constant of the rolling message-rate average
+
+WEBHOOK_NAME = "GuM It Sticky"
 
 # --- MODALS (POPUPS) ---
 
@@ -15,10 +30,11 @@ class StickyEmbedModal(ui.Modal, title="Configure Sticky Embed"):
     image_url = ui.TextInput(label="Main Image URL (Bottom)", placeholder="https://example.com/image.png", required=False)
     thumbnail_url = ui.TextInput(label="Thumbnail URL (Top Right)", placeholder="https://example.com/icon.png", required=False)
 
-    def __init__(self, bot, channel):
+    def __init__(self, bot, channel, webhook=False):
         super().__init__()
         self.bot = bot
         self.channel = channel
+        self.webhook = webhook
 
     async def on_submit(self, interaction: discord.Interaction):
         # Save Data
@@ -28,7 +44,8 @@ class StickyEmbedModal(ui.Modal, title="Configure Sticky Embed"):
             "description": self.description.value,
             "color": self.color.value,
             "image": self.image_url.value,
-            "thumbnail": self.thumbnail_url.value
+            "thumbnail": self.thumbnail_url.value,
+            "webhook": self.webhook
         }
         
         await save_and_stick(self.bot, interaction, self.channel, sticky_data)
@@ -36,49 +53,65 @@ class StickyEmbedModal(ui.Modal, title="Configure Sticky Embed"):
 class StickyTextModal(ui.Modal, title="Configure Sticky Text"):
     content = ui.TextInput(label="Message Content", style=discord.TextStyle.paragraph, placeholder="Type your sticky message here...", required=True)
 
-    def __init__(self, bot, channel):
+    def __init__(self, bot, channel, webhook=False):
         super().__init__()
         self.bot = bot
         self.channel = channel
+        self.webhook = webhook
 
     async def on_submit(self, interaction: discord.Interaction):
         sticky_data = {
             "type": "text",
-            "content": self.content.value
+            "content": self.content.value,
+            "webhook": self.webhook
         }
         await save_and_stick(self.bot, interaction, self.channel, sticky_data)
 
 # --- VIEW (BUTTONS) ---
 
 class StickyTypeView(ui.View):
-    def __init__(self, bot, channel):
+    def __init__(self, bot, channel, webhook=False):
         super().__init__()
         self.bot = bot
         self.channel = channel
+        self.webhook = webhook
 
     @ui.button(label="Simple Text", style=discord.ButtonStyle.secondary, emoji="📝")
     async def text_btn(self, interaction: discord.Interaction, button: ui.Button):
-        await interaction.response.send_modal(StickyTextModal(self.bot, self.channel))
+        await interaction.response.send_modal(StickyTextModal(self.bot, self.channel, self.webhook))
 
     @ui.button(label="Professional Embed", style=discord.ButtonStyle.primary, emoji="🎨")
     async def embed_btn(self, interaction: discord.Interaction, button: ui.Button):
-        await interaction.response.send_modal(StickyEmbedModal(self.bot, self.channel))
+        await interaction.response.send_modal(StickyEmbedModal(self.bot, self.channel, self.webhook))
+
+    @ui.button(label="Status", style=discord.ButtonStyle.secondary, emoji="📊")
+    async def status_btn(self, interaction: discord.Interaction, button: ui.Button):
+        state = self.bot.stickies.get(self.channel.id)
+        if not state:
+            return await interaction.response.send_message(f"❌ No sticky is active in {self.channel.mention}.", ephemeral=True)
+
+        embed = discord.Embed(title="📊 Sticky Status", description=f"Channel: {self.channel.mention}", color=discord.Color.blue())
+        embed.add_field(name="Message Rate", value=f"`{rate_per_minute(state):.1f}/min`", inline=True)
+        embed.add_field(name="Repost Delay", value=f"`{repost_delay(state):.1f}s` of quiet", inline=True)
+        embed.add_field(name="Bounds", value=f"`{STICKY_MIN_DELAY:g}s – {STICKY_MAX_DELAY:g}s` (max wait `{STICKY_MAX_WAIT:g}s`)", inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
 # --- HELPER FUNCTIONS ---
 
 async def save_and_stick(bot, interaction, channel, data):
-    db = get_db()
     # Save to MongoDB
-    db.sticky_messages.update_one(
-        {"_id": channel.id}, 
-        {"$set": data}, 
-        upsert=True
-    )
+    repo.save_sticky(channel.id, data)
     
-    # Update Cache
-    bot.sticky_cache[channel.id] = data
-    if channel.id not in bot.sticky_locks: 
-        bot.sticky_locks[channel.id] = asyncio.Lock()
+    # Update Cache (and re-render the payload for the new config)
+    state = bot.stickies.get(channel.id)
+    if state is None:
+        state = bot.stickies[channel.id] = StickyState(dict(data))
+    else:
+        # Merged like the $set above, so persisted fields such as the webhook survive
+        state.config.update(data)
+        if state.webhook is False:
+            state.webhook = None  # retry a webhook that failed before
+    state.payload = StickyPayload(data)
     
     # Send Confirmation
     await interaction.response.send_message(f"✅ Sticky message updated in {channel.mention}!", ephemeral=True)
@@ -107,64 +140,174 @@ def get_discord_color(color_input):
     }
     return colors.get(color_input, discord.Color.teal())
 
+class StickyPayload:
+    """Ready-to-send form of a sticky config, built once per config change."""
+    __slots__ = ("content", "embed", "webhook")
+
+    def __init__(self, data):
+        self.content = None
+        self.embed = None
+        self.webhook = bool(data.get("webhook"))
+        if data.get("type") == "embed":
+            embed = discord.Embed(
+                title=data.get("title"), 
+                description=data.get("description"), 
+                color=get_discord_color(data.get("color"))
+            )
+            
+            if data.get("image"):
+                embed.set_image(url=data.get("image"))
+            if data.get("thumbnail"):
+                embed.set_thumbnail(url=data.get("thumbnail"))
+                
+            embed.set_footer(text="📌 Sticky Message")
+            self.embed = embed
+        else:
+            # Text Mode - Sending as PLAIN TEXT
+            # We add a small bold header so it still looks distinct, 
+            # but it is NOT an embed object.
+            self.content = f"__**📌 GuM It Message:**__\n{data.get('content')}"
+
+    async def send(self, bot, channel, state):
+        if self.webhook:
+            webhook = await get_sticky_webhook(bot, channel, state)
+            if webhook:
+                try:
+                    # Webhooks have their own rate limit, so they skip the bot's outbound queue
+                    return await webhook.send(content=self.content, embed=self.embed, wait=True, username=bot.user.name, avatar_url=bot.user.display_avatar.url)
+                except discord.NotFound:
+                    forget_sticky_webhook(bot, channel.id, state)
+                except discord.HTTPException:
+                    pass
+            # Webhook unavailable: fall back to a normal bot send
+
+        # Only the newest pending repost per channel matters
+        return await bot.outbound.send(channel, PRIORITY_STICKY, merge_key=("sticky", channel.id), content=self.content, embed=self.embed)
+
+    async def delete(self, bot, channel, state, message_id):
+        # After a restart the webhook isn't loaded until something resolves it,
+        # and the old sticky (a webhook message) can only be deleted through it
+        # unless the bot has Manage Messages
+        webhook = await get_sticky_webhook(bot, channel, state) if self.webhook else None
+        if webhook:
+            try:
+                return await webhook.delete_message(message_id)
+            except discord.HTTPException:
+                pass  # Not ours (sent before a fallback) or already gone
+        await channel.get_partial_message(message_id).delete()
+
+# --- WEBHOOK DELIVERY ---
+
+async def get_sticky_webhook(bot, channel, state):
+    """
+    Returns the channel's sticky webhook, creating one only if none is stored
+    or reusable. state.webhook is False for channels where that failed.
+    """
+    if state.webhook is not None: return state.webhook or None
+
+    data = state.config
+    if data.get("webhook_id") and data.get("webhook_token"):
+        webhook = discord.Webhook.partial(data["webhook_id"], data["webhook_token"], client=bot)
+    else:
+        try:
+            ours = [w for w in await channel.webhooks() if w.name == WEBHOOK_NAME and w.token and w.user == bot.user]
+            webhook = ours[0] if ours else await channel.create_webhook(name=WEBHOOK_NAME)
+        except discord.HTTPException:
+            # Usually a missing Manage Webhooks permission
+            state.webhook = False
+            return None
+        data.update(webhook_id=webhook.id, webhook_token=webhook.token)
+        # An /unstick during the awaits above already queued the delete; an
+        # upsert here would resurrect the sticky as a webhook-only document
+        if bot.stickies.get(channel.id) is state:
+            repo.set_sticky_webhook(channel.id, webhook.id, webhook.token)
+
+    state.webhook = webhook
+    return webhook
+
+def forget_sticky_webhook(bot, channel_id, state):
+    """Drops a webhook that no longer exists so the next repost creates a new one."""
+    state.webhook = None
+    state.config.pop("webhook_id", None)
+    state.config.pop("webhook_token", None)
+    if bot.stickies.get(channel_id) is state:
+        repo.set_sticky_webhook(channel_id, None, None)
+
 async def trigger_sticky(bot, channel_id):
+    state = bot.stickies.get(channel_id)
+    if not state: return
     channel = bot.get_channel(channel_id)
     if not channel: return
     
-    data = bot.sticky_cache.get(channel_id)
-    if not data: return
-
-    # --- RATE LIMIT CHECK ---
-    # Don't stick if we sent one in the last 6 seconds
-    now = time.time()
-    last_sent = bot.sticky_cooldowns.get(channel_id, 0)
-    if now - last_sent < 6:
-        return 
-    
-    bot.sticky_cooldowns[channel_id] = now # Update time
+    # Stickies hydrated from the DB are rendered on first use
+    if state.payload is None:
+        state.payload = StickyPayload(state.config)
+    payload = state.payload
 
-    async with bot.sticky_locks[channel_id]:
+    async with state.lock:
         try:
-            # 1. Delete Old Message
-            if channel_id in bot.last_sticky_ids:
+            # 1. Delete Old Message (by ID, no fetch round-trip)
+            if state.last_message_id:
                 try:
-                    old_msg = await channel.fetch_message(bot.last_sticky_ids[channel_id])
-                    await old_msg.delete()
+                    await payload.delete(bot, channel, state, state.last_message_id)
                 except (discord.NotFound, discord.Forbidden):
                     pass # Message already gone
             
-            # 2. Prepare New Message
-            if data.get("type") == "embed":
-                embed = discord.Embed(
-                    title=data.get("title"), 
-                    description=data.get("description"), 
-                    color=get_discord_color(data.get("color"))
-                )
-                
-                if data.get("image"):
-                    embed.set_image(url=data.get("image"))
-                if data.get("thumbnail"):
-                    embed.set_thumbnail(url=data.get("thumbnail"))
-                    
-                embed.set_footer(text="📌 Sticky Message")
-                new_msg = await channel.send(embed=embed)
-            else:
-                # Text Mode - Sending as PLAIN TEXT
-                content = data.get("content")
-                # We add a small bold header so it still looks distinct, 
-                # but it is NOT an embed object.
-                msg_content = f"__**📌 GuM It Message:**__\n{content}"
-                new_msg = await channel.send(msg_content)
-
-            # 3. Save ID
-            bot.last_sticky_ids[channel_id] = new_msg.id
+            # 2. Send the pre-rendered message (None if the scheduler dropped it)
+            new_msg = await payload.send(bot, channel, state)
+            state.last_message_id = new_msg.id if new_msg else None
+            if new_msg is None: return
+
+            # 3. Save ID (persisted so a restart can still delete it)
+            if bot.stickies.get(channel_id) is state:
+                repo.set_last_sticky(channel_id, new_msg.id)
             
         except discord.Forbidden:
             # Bot lost permissions, remove from cache to stop errors
             print(f"❌ Lost permissions in {channel_id}, disabling sticky.")
-            del bot.sticky_cache[channel_id]
-            db = get_db()
-            db.sticky_messages.delete_one({"_id": channel_id})
+            bot.stickies.discard(channel_id)
+            repo.delete_sticky(channel_id)
+
+# --- REPOST SCHEDULING ---
+# Trailing-edge debounce, one timer per channel. Every message pushes the
+# repost back until the channel goes quiet, so a burst of chat costs a single
+# delete/send and the sticky still ends up last. Busier channels get a longer
+# quiet period (see STICKY_MIN/MAX_DELAY).
+
+def rate_per_minute(state):
+    """Exponentially-weighted message rate over roughly the last RATE_WINDOW seconds."""
+    return state.rate * math.exp(-(time.monotonic() - state.rate_updated) / RATE_WINDOW) * 60
+
+def repost_delay(state):
+    busy = min(1.0, rate_per_minute(state) / STICKY_BUSY_RATE)
+    return STICKY_MIN_DELAY + (STICKY_MAX_DELAY - STICKY_MIN_DELAY) * busy
+
+def touch_sticky(bot, state, channel_id):
+    """Records activity in a sticky channel and makes sure a repost is scheduled."""
+    now = time.monotonic()
+    state.rate = state.rate * math.exp(-(now - state.rate_updated) / RATE_WINDOW) + 1 / RATE_WINDOW
+    state.rate_updated = now
+
+    if state.burst_start is None:
+        state.burst_start = now
+    state.burst_last = now
+    if state.timer is None:
+        state.timer = asyncio.create_task(repost_when_quiet(bot, state, channel_id))
+
+async def repost_when_quiet(bot, state, channel_id):
+    try:
+        while True:
+            due = min(state.burst_last + repost_delay(state), state.burst_start + STICKY_MAX_WAIT)
+            delay = due - time.monotonic()
+            if delay <= 0: break
+            await asyncio.sleep(delay)
+    finally:
+        # Only clear our own timer; close() may already have dropped it
+        if state.timer is asyncio.current_task():
+            state.timer = None
+            state.burst_start = state.burst_last = None
+    # Messages arriving from here on start a new burst and a new repost
+    await trigger_sticky(bot, channel_id)
 
 # --- COG CLASS ---
 
@@ -172,40 +315,50 @@ class Sticky(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_unload(self):
+        for state in self.bot.stickies.values():
+            state.close()
+
     @commands.Cog.listener()
     async def on_message(self, message):
         if message.author.bot: return
         
         # Check if this channel has a sticky
-        if message.channel.id in self.bot.sticky_cache:
-            # Trigger Logic
-            await trigger_sticky(self.bot, message.channel.id)
+        state = self.bot.stickies.get(message.channel.id)
+        if state:
+            # Debounced: reposts once the chat settles
+            touch_sticky(self.bot, state, message.channel.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        if channel.id in self.bot.stickies:
+            self.bot.stickies.discard(channel.id)
+            repo.delete_sticky(channel.id)
 
     @app_commands.command(name="stick", description="Set up a sticky message (Text or Embed).")
-    @app_commands.describe(channel="Target channel (default: current)")
+    @app_commands.describe(channel="Target channel (default: current)", webhook="Post through a channel webhook (own rate limit, needs Manage Webhooks)")
     @commands.has_permissions(manage_messages=True)
-    async def stick(self, interaction: discord.Interaction, channel: discord.TextChannel = None):
+    async def stick(self, interaction: discord.Interaction, channel: discord.TextChannel = None, webhook: bool = False):
         target_channel = channel or interaction.channel
         
         embed = discord.Embed(
             title="📌 Sticky Configuration",
-            description=f"Setting up sticky message for {target_channel.mention}.\nChoose a style below:",
+            description=f"Setting up sticky message for {target_channel.mention}.\nChoose a style below, or check 📊 **Status** for the live repost rate:",
             color=discord.Color.blue()
         )
-        await interaction.response.send_message(embed=embed, view=StickyTypeView(self.bot, target_channel), ephemeral=True)
+        await interaction.response.send_message(embed=embed, view=StickyTypeView(self.bot, target_channel, webhook), ephemeral=True)
 
     @app_commands.command(name="unstick", description="Stop the sticky message in a channel.")
     @commands.has_permissions(manage_messages=True)
     async def unstick(self, interaction: discord.Interaction, channel: discord.TextChannel = None):
         target_channel = channel or interaction.channel
         
-        db = get_db()
-        db.sticky_messages.delete_one({"_id": target_channel.id})
-        
-        if target_channel.id in self.bot.sticky_cache: 
-            del self.bot.sticky_cache[target_channel.id]
+        repo.delete_sticky(target_channel.id)
+        # Drops config, payload, timer and cached webhook in one go. The webhook
+        # itself is left in the channel and reused by name on the next /stick.
+        self.bot.stickies.discard(target_channel.id)
             
         await interaction.response.send_message(f"🗑️ Sticky message removed from {target_channel.mention}.", ephemeral=True)
 
 async def setup(bot):
-    await bot.add_cog(Sticky(bot))
\ No newline at end of file
+    await bot.add_cog(Sticky(bot))
@@ -6,7 +6,7 @@ import random
 import asyncio
 from dotenv import load_dotenv
 from pathlib import Path
-from utils import get_db
+from utils import repo
 
 # Load env variables
 env_path = Path(__file__).parent.parent.parent / '.env'
@@ -46,7 +46,7 @@ class ActivityTextModal(ui.Modal, title="Set Activity Details"):
             await interaction.response.send_message(f"✅ **Activity Set:** {self.activity_type.name.title()} {self.text.value}", ephemeral=True)
         
         elif self.mode == "add_custom":
-            self.cog.add_custom_activity(self.activity_type, self.text.value)
+            await self.cog.add_custom_activity(self.activity_type, self.text.value)
             await interaction.response.send_message(f"✅ **Added to Pool:** {self.activity_type.name.title()} {self.text.value}", ephemeral=True)
 
 class RandomizerIntervalModal(ui.Modal, title="Loop Settings"):
@@ -301,7 +301,7 @@ class RemoveDropdown(ui.Select):
 
     async def callback(self, interaction: discord.Interaction):
         index = int(self.values[0])
-        removed = self.view.cog.remove_custom_activity(index)
+        removed = await self.view.cog.remove_custom_activity(index)
         await interaction.response.send_message(f"🗑️ Removed: **{removed['name']}**", ephemeral=True)
         await interaction.message.edit(content="**Manage Custom Pool**", view=CustomPoolManagerView(self.view.bot, self.view.cog))
 
@@ -312,33 +312,24 @@ class Status(commands.Cog):
         self.bot = bot
         self.custom_pool = []
         self.randomizer_mode = "default" 
-        self.load_pool()
 
-    def load_pool(self):
-        db = get_db()
-        doc = db.bot_settings.find_one({"_id": "status_randomizer"})
+    async def cog_load(self):
+        await self.load_pool()
+
+    async def load_pool(self):
+        doc = await repo.get_setting("status_randomizer")
         if doc and "activities" in doc:
             self.custom_pool = doc["activities"]
 
-    def add_custom_activity(self, activity_type, name):
+    async def add_custom_activity(self, activity_type, name):
         entry = {"type": int(activity_type), "name": name}
         self.custom_pool.append(entry)
-        db = get_db()
-        db.bot_settings.update_one(
-            {"_id": "status_randomizer"},
-            {"$push": {"activities": entry}},
-            upsert=True
-        )
-
-    def remove_custom_activity(self, index):
+        await repo.update_setting("status_randomizer", {"$push": {"activities": entry}})
+
+    async def remove_custom_activity(self, index):
         if 0 <= index < len(self.custom_pool):
             removed = self.custom_pool.pop(index)
-            db = get_db()
-            db.bot_settings.update_one(
-                {"_id": "status_randomizer"},
-                {"$set": {"activities": self.custom_pool}},
-                upsert=True
-            )
+            await repo.update_setting("status_randomizer", {"$set": {"activities": self.custom_pool}})
             return removed
         return None
 
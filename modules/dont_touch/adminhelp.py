@@ -52,7 +52,9 @@ class AdminHelp(commands.Cog):
                     "**`^status`**\n"
                     "Opens the Status Manager. Configure rich presence, set custom activities, or start the auto-randomizer loop.\n\n"
                     "**`^system`**\n"
-                    "Runs a deep health check. Scans all module files vs loaded extensions to find crashed cogs.\n\n"
+                    "Runs a deep health check. Scans all module files vs loaded extensions to find crashed cogs, and summarises MongoDB latency.\n\n"
+                    "**`^dbstats`**\n"
+                    "DMs the full MongoDB latency/failure metrics as a JSON file.\n\n"
                     "**`^uptime`**\n"
                     "Displays current session uptime and API latency."
                 ),
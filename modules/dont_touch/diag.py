@@ -1,10 +1,13 @@
 import discord
 from discord.ext import commands
 import os
+import io
+import json
 import time
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
+from utils import mongo_metrics
 
 # Load env from parent directory
 env_path = Path(__file__).parent.parent.parent / '.env'
@@ -28,6 +31,18 @@ class Diagnostics(commands.Cog):
             return f"{days}d {hours}h {minutes}m {seconds}s"
         return "Unknown"
 
+    def get_db_report(self, limit=6):
+        """Short per-operation latency summary for the system embed."""
+        stats = mongo_metrics.snapshot()
+        lines = []
+        for op in stats["operations"][:limit]:
+            p95 = f"≤{op['p95_ms']}ms" if op["p95_ms"] is not None else ">1s"
+            fails = f", {op['failures']} failed" if op["failures"] else ""
+            lines.append(f"`{op['command']} {op['collection']}`: {op['count']}× avg {op['avg_ms']}ms, p95 {p95}{fails}")
+        wait = stats["pool_wait"]
+        lines.append(f"Pool wait: avg `{wait['avg_ms']}ms`, max `{wait['max_ms']}ms` over {wait['count']} checkouts")
+        return "\n".join(lines)[:1024]
+
     # --- SHARED LOGIC ---
 
     async def send_uptime_embed(self, sender_func, is_ephemeral=False):
@@ -81,6 +96,8 @@ class Diagnostics(commands.Cog):
         embed.add_field(name="📶 Latency", value=f"`{round(self.bot.latency * 1000)}ms`", inline=True)
         embed.add_field(name="🏰 Guilds", value=str(len(self.bot.guilds)), inline=True)
         embed.add_field(name="👥 Users", value=str(len(self.bot.users)), inline=True)
+        embed.add_field(name="📌 Stickies", value=str(len(self.bot.stickies)), inline=True)
+        embed.add_field(name="🍃 MongoDB (slowest by total time)", value=self.get_db_report(), inline=False)
 
         if is_ephemeral:
             await sender_func(embed=embed, ephemeral=True)
@@ -146,5 +163,14 @@ class Diagnostics(commands.Cog):
             except discord.Forbidden:
                 pass
 
+        elif content == "^dbstats":
+            # Full metrics as JSON for offline analysis
+            try:
+                await message.delete()
+                dump = json.dumps(mongo_metrics.snapshot(), indent=2)
+                await message.author.send(file=discord.File(io.StringIO(dump), filename="mongo_metrics.json"))
+            except discord.Forbidden:
+                pass
+
 async def setup(bot):
     await bot.add_cog(Diagnostics(bot))
\ No newline at end of file
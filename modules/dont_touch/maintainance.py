@@ -5,7 +5,7 @@ import asyncio
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-from utils import get_db
+from utils import repo
 
 # Load configuration directly from environment variables
 env_path = Path(__file__).parent.parent.parent / '.env'
@@ -87,12 +87,7 @@ class MaintenanceModal(ui.Modal, title="📢 Start Maintenance"):
         
         # --- CRITICAL FIX: STOP STATUS LOOP ---
         # 1. Save state to DB
-        db = get_db()
-        db.bot_settings.update_one(
-            {"_id": "maintenance_mode"}, 
-            {"$set": {"active": True}}, 
-            upsert=True
-        )
+        await repo.update_setting("maintenance_mode", {"$set": {"active": True}})
         self.bot.maintenance_mode = True
 
         # 2. Stop the randomizer so it doesn't overwrite DND
@@ -151,12 +146,7 @@ class EndMaintenanceModal(ui.Modal, title="✅ End Maintenance"):
         
         # --- CRITICAL FIX: RESTART STATUS LOOP ---
         # 1. Update DB
-        db = get_db()
-        db.bot_settings.update_one(
-            {"_id": "maintenance_mode"}, 
-            {"$set": {"active": False}}, 
-            upsert=True
-        )
+        await repo.update_setting("maintenance_mode", {"$set": {"active": False}})
         self.bot.maintenance_mode = False
 
         # 2. Restart the randomizer
@@ -212,8 +202,7 @@ class Maintenance(commands.Cog):
     async def cog_load(self):
         # Restore state on bot restart
         try:
-            db = get_db()
-            data = db.bot_settings.find_one({"_id": "maintenance_mode"})
+            data = await repo.get_setting("maintenance_mode")
             if data and data.get("active"):
                 self.bot.maintenance_mode = True
                 print("⚠️  Maintenance Mode Active on Startup")
@@ -1,7 +1,22 @@
 import os
+import re
+import codecs
 import logging
+import asyncio
+import functools
+import bisect
+import heapq
+import itertools
+import threading
+import time
+import tempfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, UpdateOne, ReplaceOne, DeleteOne, monitoring
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
 import discord
 from discord.ext import commands
 import certifi  # <--- Added certifi import
@@ -17,11 +32,166 @@ OWNER_ID = int(os.getenv("OWNER_ID", 0))
 SUPPORT_SERVER_ID = int(os.getenv("SUPPORT_SERVER_ID", 0))
 PREMIUM_ROLE_ID = int(os.getenv("PREMIUM_ROLE_ID", 0))
 MONGO_URI = os.getenv("MONGO_URI")
+DB_WORKERS = int(os.getenv("DB_WORKERS", 8))
+# How long a "not premium" answer is trusted before the DB is asked again
+PREMIUM_NEGATIVE_TTL = int(os.getenv("PREMIUM_NEGATIVE_TTL", 300))
+PREMIUM_NEGATIVE_MAX = int(os.getenv("PREMIUM_NEGATIVE_MAX", 50000))
+# Write-behind: flush queued writes every N seconds or once this many are pending
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", 1.0))
+WRITE_FLUSH_SIZE = int(os.getenv("WRITE_FLUSH_SIZE", 200))
+# Failed flushes are requeued and retried, backing off up to this many seconds
+WRITE_RETRY_MAX = float(os.getenv("WRITE_RETRY_MAX", 60))
+# Reads slower than this are checked for a missing index
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", 100))
+# Outbound messages: per-channel burst/refill (Discord allows ~5 per 5s per channel)
+# and a global budget kept below the 50 req/s bot-wide limit
+OUTBOUND_CHANNEL_BURST = int(os.getenv("OUTBOUND_CHANNEL_BURST", 5))
+OUTBOUND_CHANNEL_RATE = float(os.getenv("OUTBOUND_CHANNEL_RATE", 1.0))
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 40))
+OUTBOUND_MAX_PENDING = int(os.getenv("OUTBOUND_MAX_PENDING", 1000))
+# Transcripts are stored zlib-compressed; anything larger than one chunk goes
+# to transcript_chunks in pieces this size, well under the 16 MB document cap
+TRANSCRIPT_CHUNK_BYTES = int(os.getenv("TRANSCRIPT_CHUNK_BYTES", 255 * 1024))
+# Distinct words kept per transcript for search
+TRANSCRIPT_MAX_TOKENS = int(os.getenv("TRANSCRIPT_MAX_TOKENS", 20000))
 
 # --- GLOBAL DATABASE VARIABLES ---
 # We store the client here so we don't reconnect every time
 _mongo_client = None
+_mongo_lock = threading.Lock()
 _premium_cache = set()
+_premium_negative = OrderedDict()  # user_id -> monotonic expiry, oldest first
+
+# --- MONGODB METRICS ---
+# Upper bounds (ms) of the latency histogram buckets; the last one catches the rest
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, float("inf"))
+
+class OperationStats:
+    __slots__ = ("count", "failures", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.failures = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+
+    def record(self, ms, failed=False):
+        self.count += 1
+        if failed: self.failures += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the given percentile."""
+        target = self.count * pct / 100
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += n
+            if seen >= target: return bound
+        return LATENCY_BUCKETS_MS[-1]
+
+    def to_dict(self):
+        # JSON has no infinity; the overflow bucket is reported as None / "inf"
+        finite = lambda ms: None if ms == float("inf") else ms
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0,
+            "max_ms": round(self.max_ms, 2),
+            "p50_ms": finite(self.percentile(50)),
+            "p95_ms": finite(self.percentile(95)),
+            "buckets": {str(b): n for b, n in zip(LATENCY_BUCKETS_MS, self.buckets)},
+        }
+
+class MongoMetrics:
+    """
+    Latency and failure stats per (collection, command), plus connection
+    pool wait times. Fed by the pymongo listeners below from driver threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}  # request_id -> collection
+        self._waits = threading.local()
+        self.operations = {}
+        self.pool_wait = OperationStats()
+        self.started_at = time.time()
+
+    def command_started(self, request_id, collection):
+        with self._lock:
+            self._inflight[request_id] = collection
+
+    def command_finished(self, request_id, command, ms, failed=False):
+        with self._lock:
+            collection = self._inflight.pop(request_id, None) or "-"
+            stats = self.operations.get((collection, command))
+            if stats is None:
+                stats = self.operations[(collection, command)] = OperationStats()
+            stats.record(ms, failed)
+
+    def checkout_started(self):
+        self._waits.started = time.perf_counter()
+
+    def checkout_finished(self, failed=False):
+        started = getattr(self._waits, "started", None)
+        if started is None: return
+        self._waits.started = None
+        with self._lock:
+            self.pool_wait.record((time.perf_counter() - started) * 1000, failed)
+
+    def snapshot(self):
+        """Machine-readable dump of everything recorded so far."""
+        with self._lock:
+            return {
+                "since": self.started_at,
+                "operations": [
+                    {"collection": coll, "command": cmd, **stats.to_dict()}
+                    for (coll, cmd), stats in sorted(self.operations.items(), key=lambda kv: -kv[1].total_ms)
+                ],
+                "pool_wait": self.pool_wait.to_dict(),
+            }
+
+mongo_metrics = MongoMetrics()
+
+class _CommandMetricsListener(monitoring.CommandListener):
+    def started(self, event):
+        # Most commands name their target collection as the command's value;
+        # getMore's value is the cursor id and the collection is a field
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get("collection")
+        mongo_metrics.command_started(event.request_id, target if isinstance(target, str) else None)
+
+    def succeeded(self, event):
+        mongo_metrics.command_finished(event.request_id, event.command_name, event.duration_micros / 1000)
+
+    def failed(self, event):
+        mongo_metrics.command_finished(event.request_id, event.command_name, event.duration_micros / 1000, failed=True)
+
+class _PoolMetricsListener(monitoring.ConnectionPoolListener):
+    def connection_check_out_started(self, event):
+        mongo_metrics.checkout_started()
+
+    def connection_checked_out(self, event):
+        mongo_metrics.checkout_finished()
+
+    def connection_check_out_failed(self, event):
+        mongo_metrics.checkout_finished(failed=True)
+
+    # Remaining pool events aren't tracked
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_checked_in(self, event): pass
 
 def get_db():
     """
@@ -35,65 +205,1001 @@ def get_db():
         return None
 
     if _mongo_client is None:
-        try:
-            # Added certifi for SSL certificate verification & TLS options
-            _mongo_client = MongoClient(
-                MONGO_URI, 
-                tls=True, 
-                tlsCAFile=certifi.where()
-            )
-            
-            # Verify connection works immediately
-            _mongo_client.admin.command('ping')
-            logger.info("📦 Connected to MongoDB successfully.")
-        except Exception as e:
-            logger.error(f"❌ Failed to connect to MongoDB: {e}")
-            return None
+        # Several DB worker threads may race here on first use
+        with _mongo_lock:
+            if _mongo_client is None:
+                try:
+                    # Added certifi for SSL certificate verification & TLS options
+                    client = MongoClient(
+                        MONGO_URI, 
+                        tls=True, 
+                        tlsCAFile=certifi.where(),
+                        event_listeners=[_CommandMetricsListener(), _PoolMetricsListener()]
+                    )
+                    
+                    # Verify connection works immediately
+                    client.admin.command('ping')
+                    _mongo_client = client
+                    logger.info("📦 Connected to MongoDB successfully.")
+                except Exception as e:
+                    logger.error(f"❌ Failed to connect to MongoDB: {e}")
+                    return None
             
     return _mongo_client["gumit_bot"]
 
+# --- ASYNC DATA ACCESS ---
+# pymongo is blocking, so every call made from a coroutine goes through this
+# bounded pool instead of running on the event loop.
+_db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="mongo")
+
+async def run_db(func, *args, **kwargs):
+    """Runs a blocking database function on the DB thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
+# --- WRITE-BEHIND QUEUE ---
+class WriteBehindQueue:
+    """
+    Buffers writes and sends them as one unordered bulk_write per collection.
+    Writes to the same (collection, _id) are coalesced, so a burst of edits
+    to one document costs a single operation, and counter bumps are summed
+    into one $inc. Flushed on an interval, when
+    WRITE_FLUSH_SIZE writes are pending, and on shutdown. Writes that fail
+    are put back (under anything newer for the same document) and retried
+    with backoff. Use write_now for data that must be stored before going on.
+    """
+
+    def __init__(self):
+        self._pending = {}  # (collection, _id) -> (kind, fields)
+        self._inserts = []  # (collection, doc), never coalesced
+        self._counters = {} # (collection, _id) -> ({field: delta}, set_on_insert)
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = None
+        self._task = None
+        self._failures = 0  # consecutive failed flushes
+
+    def __len__(self):
+        return len(self._pending) + len(self._inserts) + len(self._counters)
+
+    def update(self, collection, doc_id, fields):
+        """Queues a $set upsert, merged into any pending write for the doc."""
+        key = (collection, doc_id)
+        kind, current = self._pending.get(key, ("set", {}))
+        if kind == "delete":
+            # Deleted then rewritten: the result is exactly the new fields
+            kind, current = "replace", {}
+        self._pending[key] = (kind, {**current, **fields})
+        self._check_size()
+
+    def delete(self, collection, doc_id):
+        self._pending[(collection, doc_id)] = ("delete", None)
+        self._check_size()
+
+    def increment(self, collection, doc_id, deltas, set_on_insert=None):
+        """Queues an $inc upsert; set_on_insert seeds fields of a new document."""
+        key = (collection, doc_id)
+        current, seed = self._counters.get(key, ({}, set_on_insert or {}))
+        for field, delta in deltas.items():
+            current[field] = current.get(field, 0) + delta
+        self._counters[key] = (current, seed)
+        self._check_size()
+
+    def insert(self, collection, doc):
+        self._inserts.append((collection, doc))
+        self._check_size()
+
+    def _check_size(self):
+        if self._wakeup and len(self) >= WRITE_FLUSH_SIZE:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), WRITE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not await self.flush():
+                await asyncio.sleep(self._backoff())
+
+    def _backoff(self):
+        return min(WRITE_RETRY_MAX, WRITE_FLUSH_INTERVAL * 2 ** min(self._failures, 10))
+
+    async def flush(self):
+        """
+        Sends everything queued so far. Flushes never overlap, so writes stay
+        in order. Returns False if anything failed and was requeued.
+        """
+        async with self._flush_lock:
+            if not len(self): return True
+            pending, self._pending = self._pending, {}
+            inserts, self._inserts = self._inserts, []
+            counters, self._counters = self._counters, {}
+
+            # collection -> [(op, entry)], entry being what to requeue if the op fails
+            ops = {}
+            for (collection, doc_id), (kind, fields) in pending.items():
+                if kind == "delete":
+                    op = DeleteOne({"_id": doc_id})
+                elif kind == "replace":
+                    op = ReplaceOne({"_id": doc_id}, fields, upsert=True)
+                else:
+                    op = UpdateOne({"_id": doc_id}, {"$set": fields}, upsert=True)
+                ops.setdefault(collection, []).append((op, ("pending", doc_id, (kind, fields))))
+            for collection, doc in inserts:
+                ops.setdefault(collection, []).append((InsertOne(doc), ("insert", None, doc)))
+            for (collection, doc_id), (deltas, seed) in counters.items():
+                update = {"$inc": deltas}
+                if seed: update["$setOnInsert"] = seed
+                ops.setdefault(collection, []).append((UpdateOne({"_id": doc_id}, update, upsert=True), ("counter", doc_id, (deltas, seed))))
+
+            failed = []
+            for collection, batch in ops.items():
+                try:
+                    await run_db(self._bulk_write, collection, [op for op, _ in batch])
+                except BulkWriteError as e:
+                    # Unordered: everything not listed in writeErrors went through.
+                    # A duplicate key on an insert means an earlier attempt stored it.
+                    errors = [err for err in e.details.get("writeErrors", []) if not (err.get("code") == 11000 and batch[err["index"]][1][0] == "insert")]
+                    failed += [(collection, batch[err["index"]][1]) for err in errors]
+                    if errors: logger.error(f"❌ Write-behind flush to {collection}: {len(errors)}/{len(batch)} ops failed, requeued: {errors[0].get('errmsg')}")
+                except Exception as e:
+                    failed += [(collection, entry) for _, entry in batch]
+                    logger.error(f"❌ Write-behind flush to {collection} failed ({len(batch)} ops requeued): {e}")
+
+            if failed:
+                self._requeue(failed)
+                self._failures += 1
+                return False
+            self._failures = 0
+            return True
+
+    def _requeue(self, failed):
+        """Puts failed writes back behind anything queued for the same document since."""
+        inserts = []
+        for collection, (kind, doc_id, value) in failed:
+            key = (collection, doc_id)
+            if kind == "insert":
+                inserts.append((collection, value))
+            elif kind == "counter":
+                deltas, seed = value
+                if key in self._counters:
+                    newer, _ = self._counters[key]
+                    for field, delta in newer.items():
+                        deltas[field] = deltas.get(field, 0) + delta
+                self._counters[key] = (deltas, seed)
+            else:
+                newer = self._pending.get(key)
+                if newer is None:
+                    self._pending[key] = value
+                elif newer[0] == "set":
+                    old_kind, old_fields = value
+                    if old_kind == "delete":
+                        # update() saw no pending delete, so it queued a plain $set
+                        self._pending[key] = ("replace", newer[1])
+                    else:
+                        self._pending[key] = (old_kind, {**old_fields, **newer[1]})
+                # A newer delete or replace supersedes the failed write entirely
+        self._inserts[:0] = inserts
+
+    async def write_now(self, collection, ops):
+        """
+        Runs a bulk_write straight away, between flushes, and raises if it
+        fails. For documents that aren't also written through the queue.
+        """
+        async with self._flush_lock:
+            await run_db(self._bulk_write, collection, ops)
+
+    @staticmethod
+    def _bulk_write(collection, ops):
+        db = get_db()
+        if db is None: raise RuntimeError("database unavailable")
+        db[collection].bulk_write(ops, ordered=False)
+
+    async def close(self, attempts=3):
+        """Stops the flush loop and writes out whatever is still queued."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for attempt in range(attempts):
+            if await self.flush(): return
+            if attempt + 1 < attempts: await asyncio.sleep(self._backoff())
+        logger.error(f"❌ Shutting down with {len(self)} unwritten writes.")
+
+write_queue = WriteBehindQueue()
+
+_TOKEN_RE = re.compile(r"\w{2,32}")
+
+def search_tokens(text: str):
+    """Lowercased distinct words, as stored on transcripts and matched by search."""
+    return list(dict.fromkeys(_TOKEN_RE.findall(text.lower())))
+
+class Repository:
+    """
+    Async access to the bot's MongoDB collections.
+    Reads run the pymongo call on the DB thread pool and return None / empty
+    results when the database is unavailable. Writes are queued on the
+    write-behind queue and return immediately.
+    """
+
+    async def _call(self, collection, method, *args, **kwargs):
+        def work():
+            db = get_db()
+            if db is None: return None
+            started = time.perf_counter()
+            result = getattr(db[collection], method)(*args, **kwargs)
+            if method == "find_one":
+                check_slow_query(db, collection, args[0], started)
+            return result
+        return await run_db(work)
+
+    async def _find(self, collection, query=None, projection=None):
+        def work():
+            db = get_db()
+            if db is None: return []
+            started = time.perf_counter()
+            result = list(db[collection].find(query or {}, projection))
+            check_slow_query(db, collection, query or {}, started)
+            return result
+        return await run_db(work)
+
+    # guild_configs
+    async def get_guild_config(self, guild_id: int):
+        return await self._call("guild_configs", "find_one", {"_id": guild_id})
+
+    def update_guild_config(self, guild_id: int, data: dict):
+        write_queue.update("guild_configs", guild_id, data)
+
+    async def guild_configs_for(self, guild_ids):
+        return await self._find("guild_configs", {"_id": {"$in": list(guild_ids)}})
+
+    # welcome_configs
+    def set_welcome_channel(self, guild_id: int, channel_id: int):
+        write_queue.update("welcome_configs", guild_id, {"channel_id": channel_id})
+
+    async def welcome_configs_for(self, guild_ids):
+        return await self._find("welcome_configs", {"_id": {"$in": list(guild_ids)}})
+
+    # sticky_messages / sticky_roles_config
+    def save_sticky(self, channel_id: int, data: dict):
+        write_queue.update("sticky_messages", channel_id, data)
+
+    def delete_sticky(self, channel_id: int):
+        write_queue.delete("sticky_messages", channel_id)
+
+    def set_last_sticky(self, channel_id: int, message_id: int):
+        write_queue.update("sticky_messages", channel_id, {"last_message_id": message_id})
+
+    def set_sticky_webhook(self, channel_id: int, webhook_id, webhook_token):
+        write_queue.update("sticky_messages", channel_id, {"webhook_id": webhook_id, "webhook_token": webhook_token})
+
+    async def stickies_for(self, channel_ids):
+        return await self._find("sticky_messages", {"_id": {"$in": list(channel_ids)}})
+
+    async def sticky_roles_for(self, guild_ids):
+        return await self._find("sticky_roles_config", {"_id": {"$in": list(guild_ids)}})
+
+    # ticket_configs / ticket_transcripts
+    async def get_ticket_config(self, guild_id: int):
+        return await self._call("ticket_configs", "find_one", {"_id": guild_id})
+
+    def update_ticket_config(self, guild_id: int, data: dict):
+        write_queue.update("ticket_configs", guild_id, data)
+
+    async def save_transcript(self, doc: dict, data: bytes, tokens: list, size: int):
+        """
+        Writes a zlib-compressed transcript straight away, raising if that
+        fails. Small ones are stored inline, larger ones as numbered chunks
+        pointing back at the transcript's _id. tokens are its distinct words
+        for search_transcripts, size the uncompressed length.
+        """
+        doc = dict(doc, _id=ObjectId(), encoding="zlib", size=size, tokens=tokens)
+        if len(data) <= TRANSCRIPT_CHUNK_BYTES:
+            doc.update(data=data, chunks=0)
+        else:
+            # Chunks first, so a stored transcript is always complete
+            chunks = range(0, len(data), TRANSCRIPT_CHUNK_BYTES)
+            await write_queue.write_now("transcript_chunks", [
+                InsertOne({"transcript_id": doc["_id"], "n": n, "data": data[start:start + TRANSCRIPT_CHUNK_BYTES]})
+                for n, start in enumerate(chunks)
+            ])
+            doc["chunks"] = len(chunks)
+        try:
+            await write_queue.write_now("ticket_transcripts", [InsertOne(doc)])
+        except Exception:
+            if doc["chunks"]:
+                await self._call("transcript_chunks", "delete_many", {"transcript_id": doc["_id"]})
+            raise
+        return doc["_id"]
+
+    async def open_transcript(self, guild_id: int, case_id: str):
+        """
+        Returns (doc, file) for a guild's transcript, or None. The text is
+        decompressed chunk by chunk into a spooled temp file; the caller closes it.
+        """
+        def work():
+            db = get_db()
+            if db is None: return None
+            query = {"guild_id": guild_id, "case_id": case_id}
+            started = time.perf_counter()
+            doc = db["ticket_transcripts"].find_one(query, sort=[("timestamp", -1)])
+            check_slow_query(db, "ticket_transcripts", query, started)
+            if not doc: return None
+
+            out = tempfile.SpooledTemporaryFile(max_size=TRANSCRIPT_CHUNK_BYTES * 4)
+            if "content" in doc:
+                # Stored before compression was added
+                content = doc.pop("content")
+                out.write(content.encode() if isinstance(content, str) else content)
+            elif not doc.get("chunks"):
+                out.write(zlib.decompress(doc.pop("data")))
+            else:
+                inflater = zlib.decompressobj()
+                cursor = db["transcript_chunks"].find({"transcript_id": doc["_id"]}).sort("n", 1)
+                for chunk in cursor:
+                    out.write(inflater.decompress(chunk["data"]))
+                out.write(inflater.flush())
+            out.seek(0)
+            return doc, out
+        return await run_db(work)
+
+    async def search_transcripts(self, guild_id: int, words=(), owner_id=None, closed_by=None, since=None, skip=0, limit=10):
+        """
+        Newest-first transcripts of a guild containing every word, optionally
+        filtered by owner, closer and close time. Returns metadata only.
+        """
+        query = {"guild_id": guild_id}
+        if words: query["tokens"] = {"$all": list(words)}
+        if owner_id: query["owner_id"] = owner_id
+        if closed_by: query["closed_by"] = closed_by
+        if since: query["timestamp"] = {"$gte": since}
+        projection = {"case_id": 1, "owner_id": 1, "closed_by": 1, "timestamp": 1, "size": 1}
+
+        def work():
+            db = get_db()
+            if db is None: return []
+            started = time.perf_counter()
+            cursor = db["ticket_transcripts"].find(query, projection).sort("timestamp", -1).skip(skip).limit(limit)
+            result = list(cursor)
+            check_slow_query(db, "ticket_transcripts", query, started)
+            return result
+        return await run_db(work)
+
+    # open_tickets (_id = ticket channel)
+    def add_open_ticket(self, channel_id: int, guild_id: int, owner_id: int):
+        write_queue.update("open_tickets", channel_id, {"guild_id": guild_id, "owner_id": owner_id})
+
+    def remove_open_ticket(self, channel_id: int):
+        write_queue.delete("open_tickets", channel_id)
+
+    async def open_tickets_for(self, guild_id: int):
+        return await self._find("open_tickets", {"guild_id": guild_id})
+
+    # ticket_messages (append log of each open ticket, replayed on close)
+    def log_ticket_entry(self, doc: dict):
+        # Client-side ObjectIds keep entries in capture order
+        write_queue.insert("ticket_messages", dict(doc, _id=ObjectId()))
+
+    async def _flush_ticket_log(self):
+        # Queued entries must be stored before the log is read or cleared;
+        # a failed flush requeues them, so reading on would miss them
+        if not await write_queue.flush():
+            raise RuntimeError("queued ticket log entries couldn't be written")
+
+    async def ticket_log_started(self, channel_id: int):
+        """True if the ticket was captured from the start (tickets opened before capture existed weren't)."""
+        await self._flush_ticket_log()
+        return await self._call("ticket_messages", "find_one", {"channel_id": channel_id, "kind": "open"}) is not None
+
+    async def replay_ticket_log(self, channel_id: int, handle):
+        """Calls handle(entry) for each logged entry in capture order, on the DB thread. Returns the count."""
+        await self._flush_ticket_log()
+        def work():
+            db = get_db()
+            if db is None: raise RuntimeError("database unavailable")
+            count = 0
+            for entry in db["ticket_messages"].find({"channel_id": channel_id}).sort("_id", 1):
+                handle(entry)
+                count += 1
+            return count
+        return await run_db(work)
+
+    async def clear_ticket_log(self, channel_id: int):
+        """Deletes a ticket's log. It's the only other copy, so only call this once its transcript is stored."""
+        await self._flush_ticket_log()
+        await self._call("ticket_messages", "delete_many", {"channel_id": channel_id})
+
+    # ticket_events / ticket_stats_daily
+    def log_ticket_event(self, doc: dict):
+        write_queue.insert("ticket_events", doc)
+
+    def bump_ticket_stats(self, guild_id: int, day: str, deltas: dict):
+        write_queue.increment("ticket_stats_daily", f"{guild_id}:{day}", deltas, {"guild_id": guild_id, "day": day})
+
+    async def ticket_stats_since(self, guild_id: int, day: str):
+        return await self._find("ticket_stats_daily", {"guild_id": guild_id, "day": {"$gte": day}})
+
+    # temp_roles
+    def add_temp_role(self, doc: dict):
+        write_queue.insert("temp_roles", doc)
+
+    async def expired_temp_roles(self, now: float, guild_ids=None):
+        query = {"expiry": {"$lte": now}}
+        if guild_ids is not None:
+            query["guild_id"] = {"$in": list(guild_ids)}
+        return await self._find("temp_roles", query)
+
+    def delete_temp_role(self, doc_id):
+        write_queue.delete("temp_roles", doc_id)
+
+    # bot_settings
+    async def get_setting(self, key: str):
+        return await self._call("bot_settings", "find_one", {"_id": key})
+
+    async def update_setting(self, key: str, update: dict):
+        return await self._call("bot_settings", "update_one", {"_id": key}, update, upsert=True)
+
+repo = Repository()
+
+# --- INDEXES ---
+# collection -> [(keys, create_index options)]. Options may include
+# expireAfterSeconds for TTL indexes (the field must hold a BSON date).
+REQUIRED_INDEXES = {
+    "temp_roles": [
+        ([("expiry", 1)], {}),
+        ([("guild_id", 1), ("expiry", 1)], {}),
+    ],
+    "ticket_transcripts": [
+        ([("case_id", 1)], {}),
+        ([("guild_id", 1), ("timestamp", -1)], {}),
+        ([("guild_id", 1), ("tokens", 1), ("timestamp", -1)], {}),
+    ],
+    "open_tickets": [
+        ([("guild_id", 1)], {}),
+    ],
+    "ticket_messages": [
+        ([("channel_id", 1), ("_id", 1)], {}),
+    ],
+    "ticket_events": [
+        ([("guild_id", 1), ("at", -1)], {}),
+    ],
+    "ticket_stats_daily": [
+        ([("guild_id", 1), ("day", 1)], {}),
+    ],
+    "transcript_chunks": [
+        ([("transcript_id", 1), ("n", 1)], {"unique": True}),
+    ],
+    "premium_users": [
+        ([("expires_at", 1)], {}),
+    ],
+}
+
+_reported_shapes = set()
+
+def ensure_indexes():
+    """Creates any index from REQUIRED_INDEXES that doesn't exist yet. Safe to run on every start."""
+    db = get_db()
+    if db is None: return
+
+    created = 0
+    for collection, indexes in REQUIRED_INDEXES.items():
+        try:
+            existing = [list(info["key"]) for info in db[collection].index_information().values()]
+            for keys, options in indexes:
+                if keys in existing: continue
+                db[collection].create_index(keys, **options)
+                created += 1
+        except Exception as e:
+            logger.error(f"❌ Index check on {collection} failed: {e}")
+    logger.info(f"🗂️ Indexes verified ({created} created).")
+
+def check_slow_query(db, collection, query, started):
+    """Logs reads slower than SLOW_QUERY_MS, flagging ones that scanned the whole collection."""
+    elapsed = (time.perf_counter() - started) * 1000
+    if elapsed < SLOW_QUERY_MS: return
+
+    # Explain each query shape once; repeats only get the timing line
+    shape = (collection, tuple(sorted(query)))
+    if shape in _reported_shapes:
+        logger.warning(f"🐢 Slow query on {collection} {list(shape[1])}: {elapsed:.0f}ms")
+        return
+    _reported_shapes.add(shape)
+    try:
+        plan = db[collection].find(query).explain().get("queryPlanner", {}).get("winningPlan", {})
+        unindexed = "COLLSCAN" in str(plan)
+    except Exception:
+        unindexed = False
+    note = " (UNINDEXED: collection scan)" if unindexed else ""
+    logger.warning(f"🐢 Slow query on {collection} {list(shape[1])}: {elapsed:.0f}ms{note}")
+
+def _inflate(pieces, step=256 * 1024):
+    """Yields the decompressed text of a zlib stream given as pieces, at most step bytes at a time."""
+    inflater = zlib.decompressobj()
+    for piece in pieces:
+        while piece:
+            yield inflater.decompress(piece, step)
+            piece = inflater.unconsumed_tail
+    yield inflater.flush()
+
+def _stream_tokens(pieces):
+    """search_tokens over UTF-8 text given as byte pieces, without joining them."""
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    tokens, tail = {}, ""
+    for piece in pieces:
+        text = tail + decoder.decode(piece)
+        # Hold back the last partial word; it may continue in the next piece
+        cut = max(text.rfind(" "), text.rfind("\n"))
+        if cut < 0 and len(text) < 65536:
+            tail = text
+            continue
+        cut = len(text) if cut < 0 else cut
+        for word in search_tokens(text[:cut]): tokens.setdefault(word)
+        tail = text[cut:]
+        if len(tokens) >= TRANSCRIPT_MAX_TOKENS: break
+    for word in search_tokens(tail + decoder.decode(b"", final=True)): tokens.setdefault(word)
+    return list(tokens)[:TRANSCRIPT_MAX_TOKENS]
+
+def backfill_transcript_tokens(batch_size=100):
+    """
+    One-off: adds search tokens to transcripts saved before search existed,
+    inflating them chunk by chunk. Records completion in bot_settings so
+    later starts skip the scan.
+    """
+    db = get_db()
+    if db is None: return
+    if db["bot_settings"].find_one({"_id": "transcript_tokens_backfill"}): return
+
+    done, failed, ops = 0, 0, []
+    cursor = db["ticket_transcripts"].find({"tokens": {"$exists": False}}, {"content": 1, "data": 1, "chunks": 1})
+    for doc in cursor:
+        try:
+            if "content" in doc:
+                content = doc["content"]
+                pieces = [content.encode() if isinstance(content, str) else content]
+            elif not doc.get("chunks"):
+                pieces = _inflate([doc["data"]])
+            else:
+                chunks = db["transcript_chunks"].find({"transcript_id": doc["_id"]}).sort("n", 1)
+                pieces = _inflate(chunk["data"] for chunk in chunks)
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"tokens": _stream_tokens(pieces)}}))
+        except Exception as e:
+            failed += 1
+            logger.error(f"❌ Token backfill skipped transcript {doc['_id']}: {e}")
+        if len(ops) >= batch_size:
+            db["ticket_transcripts"].bulk_write(ops, ordered=False)
+            done += len(ops)
+            ops = []
+    if ops:
+        db["ticket_transcripts"].bulk_write(ops, ordered=False)
+        done += len(ops)
+
+    if not failed:
+        db["bot_settings"].update_one({"_id": "transcript_tokens_backfill"}, {"$set": {"done_at": time.time(), "count": done}}, upsert=True)
+    if done or failed:
+        logger.info(f"🔎 Backfilled search tokens on {done} transcripts ({failed} failed).")
+
+# --- GUILD CONFIG CACHE ---
+class GuildConfigCache:
+    """
+    Write-through mirror of the guild_configs collection.
+    Reads are plain dict lookups; every write is queued for MongoDB and
+    applied in memory at the same time.
+    """
+
+    def __init__(self):
+        self._configs = {}
+
+    def load(self, docs):
+        """
+        Adds the given guild_configs documents. Fields already cached win:
+        they were written through update() and may still be queued.
+        """
+        for doc in docs:
+            cached = self._configs.get(doc["_id"])
+            self._configs[doc["_id"]] = {**doc, **cached} if cached else doc
+
+    def evict(self, guild_id):
+        self._configs.pop(guild_id, None)
+
+    def get(self, guild_id):
+        """Returns the guild's config document, or an empty dict."""
+        return self._configs.get(guild_id, {})
+
+    def __len__(self):
+        return len(self._configs)
+
+    def update(self, guild_id, data):
+        """Queues `data` for guild_configs and merges it into the cached doc."""
+        repo.update_guild_config(guild_id, data)
+        self._configs.setdefault(guild_id, {"_id": guild_id}).update(data)
+
+# --- STICKY STATE ---
+class StickyState:
+    """Everything kept in memory for one sticky channel."""
+    __slots__ = ("config", "payload", "webhook", "lock", "last_message_id",
+                 "burst_start", "burst_last", "rate", "rate_updated", "timer")
+
+    def __init__(self, config):
+        self.config = config                # sticky_messages document
+        self.payload = None                 # rendered message, built on first use
+        self.webhook = None                 # Webhook, or False if it couldn't be made
+        self.lock = asyncio.Lock()
+        self.last_message_id = config.get("last_message_id")
+        self.burst_start = None             # debounce window (monotonic)
+        self.burst_last = None
+        self.rate = 0.0                     # msgs/sec, exponentially weighted
+        self.rate_updated = 0.0
+        self.timer = None                   # pending repost task
+
+    def close(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+class StickyStates(dict):
+    """channel_id -> StickyState for every active sticky."""
+
+    def discard(self, channel_id):
+        state = self.pop(channel_id, None)
+        if state: state.close()
+
+# --- OUTBOUND MESSAGE SCHEDULER ---
+# Priority classes, most important first
+PRIORITY_MODERATION = 0
+PRIORITY_LOGS = 1
+PRIORITY_STICKY = 2
+PRIORITY_WELCOME = 3
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self.wait_time(now)
+        return self.tokens >= self.capacity
+
+class _OutboundJob:
+    __slots__ = ("channel", "priority", "key", "items", "build", "deadline", "futures")
+
+    def __init__(self, channel, priority, key, item, build, deadline):
+        self.channel = channel
+        self.priority = priority
+        self.key = key
+        self.items = [item]
+        self.build = build
+        self.deadline = deadline
+        self.futures = []
+
+class OutboundScheduler:
+    """
+    Central queue for bot-initiated channel messages (logs, stickies, welcomes).
+    Sends go out highest priority first while a per-channel and a global token
+    bucket allow it, so a raid or chat storm degrades into delayed, merged or
+    dropped low-priority messages instead of a wall of 429s.
+
+    Policies per message:
+    - merge_key: a pending message with the same key is merged instead of
+      queued again (replaced, or batched when `build` is given)
+    - ttl: seconds after which an unsent message is dropped
+    - when OUTBOUND_MAX_PENDING is reached the lowest priority message is dropped
+    Dropped messages resolve to None.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_RATE)
+        self._buckets = {}   # channel_id -> TokenBucket
+        self._jobs = []      # sorted (priority, seq, job)
+        self._by_key = {}    # merge_key -> job
+        self._seq = itertools.count()
+        self._inflight = set()
+        self._wakeup = None
+        self._task = None
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def submit(self, channel, priority, merge_key=None, ttl=None, build=None, item=None, **kwargs):
+        """
+        Queues a message and returns a future for the sent Message (or None).
+        Plain sends pass channel.send kwargs; batched sends pass an `item` and
+        a `build(items) -> kwargs` function that renders every merged item.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(_retrieve_exception)
+        item = kwargs if build is None else item
+
+        job = self._by_key.get(merge_key) if merge_key is not None else None
+        if job is not None:
+            if build is None: job.items = [item]
+            else: job.items.append(item)
+            job.futures.append(future)
+            self.merged += 1
+            return future
+
+        deadline = time.monotonic() + ttl if ttl else None
+        job = _OutboundJob(channel, priority, merge_key, item, build, deadline)
+        job.futures.append(future)
+        bisect.insort(self._jobs, (priority, next(self._seq), job), key=lambda entry: entry[:2])
+        if merge_key is not None:
+            self._by_key[merge_key] = job
+
+        if len(self._jobs) > OUTBOUND_MAX_PENDING:
+            self._drop(self._jobs[-1])
+        if self._wakeup: self._wakeup.set()
+        return future
+
+    async def send(self, channel, priority, **kwargs):
+        """submit() and wait for the result."""
+        return await self.submit(channel, priority, **kwargs)
+
+    def _remove(self, entry):
+        self._jobs.remove(entry)
+        job = entry[2]
+        if job.key is not None and self._by_key.get(job.key) is job:
+            del self._by_key[job.key]
+
+    def _drop(self, entry):
+        self._remove(entry)
+        self.dropped += 1
+        for future in entry[2].futures:
+            if not future.done(): future.set_result(None)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for entry in list(self._jobs):
+            self._drop(entry)
+
+    def _bucket(self, channel_id):
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket(OUTBOUND_CHANNEL_BURST, OUTBOUND_CHANNEL_RATE)
+        return bucket
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            for entry in [e for e in self._jobs if e[2].deadline and e[2].deadline <= now]:
+                self._drop(entry)
+
+            if not self._jobs:
+                # Idle: forget channels whose bucket has fully refilled
+                self._buckets = {cid: b for cid, b in self._buckets.items() if not b.is_full(now)}
+                wait = None
+            else:
+                wait = self._dispatch(now)
+                if wait == 0: continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, now):
+        """Starts the best sendable job. Returns 0 if one started, else seconds until one can."""
+        wait = self.global_bucket.wait_time(now)
+        if wait: return wait
+
+        wait = None
+        for entry in self._jobs:
+            bucket = self._bucket(entry[2].channel.id)
+            channel_wait = bucket.wait_time(now)
+            if channel_wait == 0:
+                self._remove(entry)
+                self.global_bucket.take()
+                bucket.take()
+                task = asyncio.create_task(self._deliver(entry[2]))
+                self._inflight.add(task)
+                task.add_done_callback(self._inflight.discard)
+                return 0
+            wait = channel_wait if wait is None else min(wait, channel_wait)
+        return wait
+
+    async def _deliver(self, job):
+        kwargs = job.items[-1] if job.build is None else job.build(job.items)
+        try:
+            message = await job.channel.send(**kwargs)
+            self.sent += 1
+        except Exception as e:
+            if not isinstance(e, (discord.Forbidden, discord.NotFound)):
+                logger.warning(f"Outbound send to {job.channel.id} failed: {e}")
+            for future in job.futures:
+                if not future.done(): future.set_exception(e)
+            return
+        for future in job.futures:
+            if not future.done(): future.set_result(message)
+
+def _retrieve_exception(future):
+    # Fire-and-forget callers never await the future; don't warn about it
+    if not future.cancelled(): future.exception()
+
+# --- PREMIUM EXPIRY ---
+class PremiumExpiryScheduler:
+    """
+    Keeps upcoming premium expiries (unix timestamps) in a min-heap and
+    evicts each user from the premium cache as soon as theirs passes.
+    Entries that were rescheduled or cancelled are skipped lazily.
+    """
+
+    MAX_SLEEP = 3600  # re-check at least hourly in case the clock jumps
+
+    def __init__(self):
+        self._heap = []
+        self._expiries = {}
+        self._wakeup = None
+        self._task = None
+
+    def load(self, expiries):
+        """Replaces the schedule with a {user_id: expires_at} mapping."""
+        self._expiries = dict(expiries)
+        self._heap = [(ts, uid) for uid, ts in self._expiries.items()]
+        heapq.heapify(self._heap)
+        if self._wakeup: self._wakeup.set()
+
+    def schedule(self, user_id, expires_at):
+        """Sets (or clears, with None) the expiry for a user."""
+        if expires_at is None:
+            self._expiries.pop(user_id, None)
+            return
+        self._expiries[user_id] = expires_at
+        heapq.heappush(self._heap, (expires_at, user_id))
+        # Only an earlier deadline than the one being slept on needs a wakeup
+        if self._wakeup and self._heap[0] == (expires_at, user_id):
+            self._wakeup.set()
+
+    def cancel(self, user_id):
+        self._expiries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._expiries)
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                expires_at, user_id = heapq.heappop(self._heap)
+                if self._expiries.get(user_id) != expires_at: continue
+                remove_premium_cache(user_id)
+                logger.info(f"💎 Premium expired for {user_id}.")
+
+            timeout = self.MAX_SLEEP
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+premium_expiry = PremiumExpiryScheduler()
+
+def _is_entitled(doc):
+    """True if a premium_users document has not expired."""
+    expires_at = doc.get("expires_at")
+    return expires_at is None or expires_at > time.time()
+
 # --- CACHE MANAGEMENT ---
 def load_premium_cache():
-    """Loads all premium user IDs into memory on startup."""
+    """Loads all active premium user IDs (and their expiries) into memory on startup."""
     global _premium_cache
     db = get_db()
     if db is None: return
 
     try:
-        # Fetch only the _id field for all premium users
-        cursor = db.premium_users.find({}, {"_id": 1})
-        _premium_cache = {doc["_id"] for doc in cursor}
-        logger.info(f"💎 Loaded {len(_premium_cache)} premium users into cache.")
+        # Only live entitlements; lifetime users have no expires_at
+        query = {"$or": [{"expires_at": None}, {"expires_at": {"$gt": time.time()}}]}
+        docs = list(db.premium_users.find(query, {"_id": 1, "expires_at": 1}))
+        _premium_cache = {doc["_id"] for doc in docs}
+        premium_expiry.load({doc["_id"]: doc["expires_at"] for doc in docs if doc.get("expires_at") is not None})
+        logger.info(f"💎 Loaded {len(_premium_cache)} premium users into cache ({len(premium_expiry)} expiring).")
     except Exception as e:
         logger.error(f"Failed to load premium cache: {e}")
 
-def add_premium_cache(user_id):
-    """Updates cache when a user buys/redeems premium."""
+def add_premium_cache(user_id, expires_at=None):
+    """Updates cache when a user buys/redeems premium. `expires_at` is a unix timestamp, None for lifetime."""
     _premium_cache.add(user_id)
+    _premium_negative.pop(user_id, None)
+    premium_expiry.schedule(user_id, expires_at)
 
 def remove_premium_cache(user_id):
-    """Updates cache when premium expires."""
+    """Updates cache when premium expires or is revoked."""
+    premium_expiry.cancel(user_id)
     if user_id in _premium_cache:
         _premium_cache.remove(user_id)
 
+def _is_known_free(user_id):
+    """True if the user was recently confirmed as NOT premium."""
+    expires = _premium_negative.get(user_id)
+    if expires is None: return False
+    if expires <= time.monotonic():
+        del _premium_negative[user_id]
+        return False
+    return True
+
+def _remember_free(user_id):
+    _premium_negative[user_id] = time.monotonic() + PREMIUM_NEGATIVE_TTL
+    _premium_negative.move_to_end(user_id)
+    while len(_premium_negative) > PREMIUM_NEGATIVE_MAX:
+        _premium_negative.popitem(last=False)
+
+def _lookup_premium(user_id):
+    """Returns (looked_up, doc). looked_up is False when the DB couldn't be asked."""
+    db = get_db()
+    if db is None: return False, None
+    return True, db.premium_users.find_one({"_id": user_id})
+
 # --- CHECKS ---
 def check_premium_status(user_id):
     """Checks cache first (instant), falls back to DB if needed."""
     if user_id == OWNER_ID:
         return True
     
-    # 1. Fast Cache Check
+    # 1. Fast Cache Checks
     if user_id in _premium_cache:
         return True
+    if _is_known_free(user_id):
+        return False
     
-    # 2. Safety Fallback (Optional: In case cache isn't loaded yet)
-    # Usually strictly relying on cache is better for speed, 
-    # but we can do a DB check just in case.
-    db = get_db()
-    if db and db.premium_users.find_one({"_id": user_id}):
-        add_premium_cache(user_id)
+    # 2. Safety Fallback (In case the purchase happened after startup)
+    looked_up, doc = _lookup_premium(user_id)
+    if doc and _is_entitled(doc):
+        add_premium_cache(user_id, doc.get("expires_at"))
         return True
         
+    # Only a real answer is remembered; a DB outage shouldn't lock anyone out
+    if looked_up: _remember_free(user_id)
+    return False
+
+async def check_premium_status_async(user_id):
+    """Same as check_premium_status, but the DB fallback runs off the event loop."""
+    if user_id == OWNER_ID:
+        return True
+    if user_id in _premium_cache:
+        return True
+    if _is_known_free(user_id):
+        return False
+
+    looked_up, doc = await run_db(_lookup_premium, user_id)
+    if doc and _is_entitled(doc):
+        add_premium_cache(user_id, doc.get("expires_at"))
+        return True
+
+    if looked_up: _remember_free(user_id)
     return False
 
 class PremiumCog(commands.Cog):
@@ -102,7 +1208,7 @@ class PremiumCog(commands.Cog):
     require the user to be a Premium member to use ANY command inside it.
     """
     async def cog_check(self, ctx):
-        if check_premium_status(ctx.author.id):
+        if await check_premium_status_async(ctx.author.id):
             return True
         else:
             embed = discord.Embed(